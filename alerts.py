@@ -0,0 +1,279 @@
+import atexit
+import queue
+import threading
+import time
+from flask import current_app
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError
+from models import db, Product, Location, StockBalance, LowStockAlert, DemandStat
+from ledger import keys_filter
+
+
+def touched_keys(*movements):
+    """(product_id, location_id) keys whose balance a movement changed"""
+    keys = set()
+    for movement in movements:
+        if movement.from_location:
+            keys.add((movement.product_id, movement.from_location))
+        if movement.to_location:
+            keys.add((movement.product_id, movement.to_location))
+    return keys
+
+
+def check_low_stock(keys, threshold):
+    """Find touched keys that just dropped to their reorder point, and forget ones that recovered.
+
+    The reorder point comes from demand_stat; keys without one use threshold. Returns
+    the items that need an alert. Keys that were already alerted are skipped until
+    their stock goes back above it. Commits the alert bookkeeping.
+    """
+    keys = set(keys)
+    if not keys:
+        return []
+
+    # A parallel request may record the same alert first; then retry, and it counts as already sent
+    try:
+        return _check_low_stock(keys, threshold)
+    except IntegrityError:
+        db.session.rollback()
+        return _check_low_stock(keys, threshold)
+
+
+def _check_low_stock(keys, threshold, chunk_size=400):
+    # In chunks, since SQLite rejects an OR of more than about 1000 equalities
+    keys = list(keys)
+    rows, alerted = [], set()
+    for i in range(0, len(keys), chunk_size):
+        chunk = keys[i:i + chunk_size]
+        rows += db.session.query(
+            StockBalance.product_id,
+            Product.name,
+            StockBalance.location_id,
+            Location.name,
+            StockBalance.qty,
+            func.coalesce(DemandStat.reorder_point, threshold)
+        ).join(Product, Product.product_id == StockBalance.product_id) \
+         .join(Location, Location.location_id == StockBalance.location_id) \
+         .outerjoin(DemandStat, and_(DemandStat.product_id == StockBalance.product_id,
+                                     DemandStat.location_id == StockBalance.location_id)) \
+         .filter(keys_filter(chunk)) \
+         .all()
+        alerted.update((a.product_id, a.location_id) for a in LowStockAlert.query.filter(
+            or_(*[and_(LowStockAlert.product_id == product_id, LowStockAlert.location_id == location_id)
+                  for product_id, location_id in chunk])
+        ))
+
+    items = []
+    for product_id, product_name, location_id, location_name, qty, reorder_point in rows:
+        key = (product_id, location_id)
+        if qty <= reorder_point and key not in alerted:
+            db.session.add(LowStockAlert(product_id=product_id, location_id=location_id, qty=qty))
+            items.append({
+                'product_id': product_id,
+                'product_name': product_name,
+                'location_id': location_id,
+                'location_name': location_name,
+                'qty': qty
+            })
+        elif qty > reorder_point and key in alerted:
+            LowStockAlert.query.filter_by(product_id=product_id, location_id=location_id) \
+                .delete(synchronize_session=False)
+    db.session.commit()
+    return items
+
+
+def queue_low_stock_alerts(keys, config):
+    """Check the touched keys and hand any new alerts to the background mailer"""
+    items = check_low_stock(keys, config['LOW_STOCK_THRESHOLD'])
+    if items and config.get('MAIL_ALERTS_ENABLED', True):
+        get_mailer(config, current_app._get_current_object()).enqueue(items)
+    return items
+
+
+def forget_alerts(items, chunk_size=400):
+    """Delete the alert rows of items whose email wasn't sent, so the next check alerts again. Commits."""
+    keys = [(item['product_id'], item['location_id']) for item in items]
+    for i in range(0, len(keys), chunk_size):
+        LowStockAlert.query.filter(or_(*[
+            and_(LowStockAlert.product_id == product_id, LowStockAlert.location_id == location_id)
+            for product_id, location_id in keys[i:i + chunk_size]
+        ])).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def build_digest(items, sender, recipient):
+    """One email listing every low stock item in the batch"""
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = recipient
+    if len(items) == 1:
+        msg['Subject'] = f'⚠️ Low Stock Alert: {items[0]["product_name"]}'
+    else:
+        msg['Subject'] = f'⚠️ Low Stock Alert: {len(items)} items'
+
+    rows = ''.join(f"""
+                <tr>
+                    <td style="padding: 8px;">{item['product_name']} ({item['product_id']})</td>
+                    <td style="padding: 8px;">{item['location_name']}</td>
+                    <td style="padding: 8px; color: #dc2626; font-weight: bold;">{item['qty']}</td>
+                </tr>""" for item in items)
+    body = f"""
+        <html>
+        <body style="font-family: Arial, sans-serif;">
+            <h2 style="color: #dc2626;">Low Stock Alert</h2>
+            <p>The following products are running low on stock:</p>
+            <table style="border-collapse: collapse; margin: 20px 0;">
+                <tr>
+                    <th style="padding: 8px; text-align: left;">Product</th>
+                    <th style="padding: 8px; text-align: left;">Location</th>
+                    <th style="padding: 8px; text-align: left;">Current Quantity</th>
+                </tr>{rows}
+            </table>
+            <p style="color: #666;">Please restock these items soon.</p>
+        </body>
+        </html>
+        """
+    msg.attach(MIMEText(body, 'html'))
+    return msg
+
+
+class AlertMailer:
+    """Sends queued low stock alerts from a background thread.
+
+    Alerts arriving within MAIL_DIGEST_WINDOW seconds of each other go out as one
+    digest, and the SMTP session is kept open between digests until it has been
+    idle for MAIL_IDLE_TIMEOUT seconds. If a digest can't be sent, its alert rows
+    are deleted in app's context (see forget_alerts) so those items alert again.
+    """
+
+    def __init__(self, config, app=None):
+        self.config = {key: config.get(key) for key in (
+            'MAIL_SERVER', 'MAIL_PORT', 'MAIL_USE_TLS', 'MAIL_USERNAME', 'MAIL_PASSWORD', 'ADMIN_EMAIL'
+        )}
+        self.digest_window = config.get('MAIL_DIGEST_WINDOW', 5)
+        self.digest_max_items = config.get('MAIL_DIGEST_MAX_ITEMS', 50)
+        self.idle_timeout = config.get('MAIL_IDLE_TIMEOUT', 60)
+        self.app = app
+        self.queue = queue.Queue()
+        self.sent_digests = 0
+        self._smtp = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='alert-mailer', daemon=True)
+                self._thread.start()
+
+    def enqueue(self, items):
+        self.start()
+        for item in items:
+            self.queue.put(item)
+
+    def stop(self, timeout=10):
+        """Send whatever is queued, close the SMTP session and stop the worker"""
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._close()
+                continue
+            if item is None:
+                self._close()
+                return
+
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.digest_window
+            while len(batch) < self.digest_max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._send(batch)
+            if stopping:
+                self._close()
+                return
+
+    def _connect(self):
+        import smtplib
+        config = self.config
+        server = smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'])
+        server.ehlo()
+        if config['MAIL_USE_TLS']:
+            server.starttls()
+            server.ehlo()
+        if config['MAIL_USERNAME'] and config['MAIL_PASSWORD'] and server.has_extn('auth'):
+            server.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+        return server
+
+    def _close(self):
+        import smtplib
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+    def _send(self, batch):
+        import smtplib
+        msg = build_digest(batch, self.config['MAIL_USERNAME'], self.config['ADMIN_EMAIL'])
+        # A pooled session may have been dropped by the server, so retry once on a fresh one
+        for attempt in range(2):
+            try:
+                if self._smtp is None:
+                    self._smtp = self._connect()
+                self._smtp.send_message(msg)
+                self.sent_digests += 1
+                return True
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+            except Exception as e:
+                print(f"Error sending email: {e}")
+                self._close()
+                break
+        else:
+            print("Error sending email: SMTP server disconnected")
+        self._forget(batch)
+        return False
+
+    def _forget(self, batch):
+        if self.app is None:
+            return
+        with self.app.app_context():
+            try:
+                forget_alerts(batch)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error clearing unsent alerts: {e}")
+
+
+_mailer = None
+_mailer_lock = threading.Lock()
+
+
+def get_mailer(config, app=None):
+    """The process-wide mailer, created on first use"""
+    global _mailer
+    with _mailer_lock:
+        if _mailer is None:
+            _mailer = AlertMailer(config, app)
+            atexit.register(_mailer.stop)
+        return _mailer
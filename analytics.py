@@ -0,0 +1,136 @@
+import math
+from datetime import datetime, timedelta
+from sqlalchemy import (Column, Date, Float, Integer, MetaData, String, Table, and_, case, cast, delete, func, insert,
+                        literal, or_, select, tuple_)
+from models import db, ProductMovement, DemandStat
+
+# Keys of a large refresh, one row each, so its statements join against them instead of
+# carrying an OR of equalities per chunk (which costs far more to compile than to run)
+demand_keys = Table(
+    'demand_keys', MetaData(),
+    Column('product_id', String(20), primary_key=True),
+    Column('location_id', String(20), primary_key=True),
+    prefixes=['TEMPORARY']
+)
+
+
+def _key_filter(keys, product_column, location_column):
+    """Rows whose (product, location) is in keys: a list of pairs, or the demand_keys table"""
+    if keys is demand_keys:
+        # A row value IN a subquery (unlike IN a literal list) walks the key table and looks each key up by index
+        return tuple_(product_column, location_column).in_(select(demand_keys.c.product_id, demand_keys.c.location_id))
+    return or_(*[and_(product_column == product_id, location_column == location_id)
+                 for product_id, location_id in keys])
+
+
+def demand_window(days, today=None):
+    """Start of a window of days whole days ending today (UTC, like movement timestamps)"""
+    today = today or datetime.utcnow().date()
+    return datetime.combine(today - timedelta(days=days - 1), datetime.min.time())
+
+
+def demand_query(since, keys=None):
+    """(product_id, location_id, total, squares) of the daily outbound quantities since since.
+
+    Two GROUP BYs: daily totals per key, then their sum and sum of squares, so the
+    database does the per-movement work and one row per key comes back. keys limits
+    it to those pairs (via the product/from_location index), given as a list or as
+    the demand_keys table.
+    """
+    daily = select(
+        ProductMovement.product_id.label('product_id'),
+        ProductMovement.from_location.label('location_id'),
+        func.sum(ProductMovement.qty).label('qty')
+    ).where(ProductMovement.from_location.isnot(None), ProductMovement.timestamp >= since)
+    if keys is not None:
+        daily = daily.where(_key_filter(keys, ProductMovement.product_id, ProductMovement.from_location))
+    # Day first: grouped by product_id first, SQLite walks the whole product/from_location
+    # index to skip a sort, rather than reading only the window through the timestamp index
+    daily = daily.group_by(func.date(ProductMovement.timestamp), ProductMovement.product_id,
+                           ProductMovement.from_location).subquery()
+    return select(
+        daily.c.product_id, daily.c.location_id, func.sum(daily.c.qty), func.sum(daily.c.qty * daily.c.qty)
+    ).group_by(daily.c.product_id, daily.c.location_id)
+
+
+def demand_stat_rows(since, days, lead_days, service_z, keys=None):
+    """SELECT of demand_stat rows (product_id, location_id, velocity, reorder_point, window_start).
+
+    Velocity is the mean daily quantity out, days without any counting as zero. The
+    reorder point covers lead_days of it plus service_z standard deviations. Worked
+    out in SQL (sqrt and ceil: SQLite 3.35+ or PostgreSQL) so a full refresh never
+    brings a row per key into Python.
+    """
+    demand = demand_query(since, keys).subquery()
+    velocity = cast(demand.c[2], Float) / days
+    variance = cast(demand.c[3], Float) / days - velocity * velocity
+    deviation = func.sqrt(case((variance > 0, variance), else_=0.0))
+    return select(
+        demand.c.product_id, demand.c.location_id, velocity,
+        cast(func.ceil(velocity * lead_days + service_z * deviation * math.sqrt(lead_days)), Integer),
+        literal(since.date(), Date)
+    )
+
+
+def refresh_demand(config, keys=None, max_keys=400):
+    """Recompute the demand_stat rows for keys, or all of them when keys is None.
+
+    Runs in the caller's transaction, so a write's movements and the demand figures
+    they change commit together. Keys with no outbound demand in the window end up
+    without a row. More than max_keys keys (bulk imports) are refreshed in one pass
+    through the demand_keys temp table.
+    """
+    days = config.get('DEMAND_WINDOW_DAYS', 90)
+    since = demand_window(days)
+    columns = ['product_id', 'location_id', 'velocity', 'reorder_point', 'window_start']
+
+    def refresh(scope=None):
+        stale = delete(DemandStat)
+        if scope is not None:
+            stale = stale.where(_key_filter(scope, DemandStat.product_id, DemandStat.location_id))
+        db.session.execute(stale)
+        db.session.execute(insert(DemandStat).from_select(columns, demand_stat_rows(
+            since, days, config.get('REORDER_LEAD_DAYS', 7), config.get('REORDER_SERVICE_Z', 1.65), scope)))
+
+    if keys is None:
+        refresh()
+        return
+    keys = set(keys)
+    if len(keys) <= max_keys:
+        if keys:
+            refresh(list(keys))
+        return
+    # Bulk writes: load the keys into a temp table (per connection) and refresh them all in one go
+    connection = db.session.connection()
+    demand_keys.create(connection, checkfirst=True)
+    connection.execute(delete(demand_keys))
+    connection.execute(insert(demand_keys), [{'product_id': product_id, 'location_id': location_id}
+                                             for product_id, location_id in keys])
+    refresh(demand_keys)
+    connection.execute(delete(demand_keys))
+
+
+def load_demand():
+    """{(product_id, location_id): (velocity, reorder_point)} for every key with outbound demand"""
+    return {(product_id, location_id): (velocity, reorder_point)
+            for product_id, location_id, velocity, reorder_point in db.session.query(
+                DemandStat.product_id, DemandStat.location_id, DemandStat.velocity, DemandStat.reorder_point)}
+
+
+def with_demand(items, demand, default_reorder_point):
+    """Copies of balance items with velocity, days_of_cover, reorder_point and low added.
+
+    Keys without outbound demand in the window fall back to default_reorder_point.
+    """
+    result = []
+    for item in items:
+        velocity, reorder_point = demand.get((item['product_id'], item['location_id']),
+                                             (0, default_reorder_point))
+        result.append({
+            **item,
+            'velocity': round(velocity, 2),
+            'days_of_cover': round(item['qty'] / velocity, 1) if velocity else None,
+            'reorder_point': reorder_point,
+            'low': item['qty'] <= reorder_point
+        })
+    return result
@@ -1,28 +1,117 @@
-from flask import Flask, render_template, redirect, url_for, flash, request, send_file
+from flask import (Flask, Blueprint, render_template, redirect, url_for, flash, request, send_file, Response,
+                   stream_with_context, abort, current_app)
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from werkzeug.local import LocalProxy
+from markupsafe import Markup
 from werkzeug.security import generate_password_hash, check_password_hash
-from models import db, User, Product, Location, ProductMovement
+from models import db, User, Product, Location, ProductMovement, StockBalance, DemandStat, LowStockAlert
 from forms import LoginForm, ProductForm, LocationForm, MovementForm
-from utils import generate_report_pdf, send_low_stock_alert, calculate_balance
+from utils import generate_report_pdf, calculate_balance, BALANCE_ENGINES
+from ledger import (apply_movement, verify_ledger, rebuild_ledger, iter_balances, set_balance, BalanceConflict,
+                    product_balances, location_balances, balances_for_keys, unknown_ids)
+from alerts import touched_keys, queue_low_stock_alerts
+from listings import (movements_page, recent_movements, parse_date, product_has_movements, location_has_movements,
+                      movements_after, movement_dict)
+from migrations import upgrade, current_version, check_query_plans
+from exports import EXPORT_FORMATS, ReportJobs
+from bulk import parse_movements, import_movements
+from choices import invalidate_choices, product_choices, location_choices, search_products
+from cache import TTLCache, VersionFile, FileCache
+from changes import ChangeFeed, record_changes, record_reset, current_seq
+from users import load_session_user
+from analytics import refresh_demand, load_demand, with_demand
+from instrumentation import init_instrumentation, metrics
+from rendering import init_rendering
+from datagen import generate_inventory
+from catalog import products_page, locations_page, product_dict, location_dict
+from snapshots import parse_as_of, balances_as_of, take_snapshots, compact_history, invalidate_snapshots
+from database import configure_database
 from config import Config
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import click
+import csv
+import hashlib
+import itertools
+import os
+import time
 
-app = Flask(__name__)
-app.config.from_object(Config)
+# Routes and CLI commands; create_app() registers them on an app
+bp = Blueprint('main', __name__, cli_group=None)
 
-# Initialize extensions
-db.init_app(app)
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
+
+def create_app(config=Config):
+    """Build and configure the app. Doesn't touch the database: run `flask --app app init-db` to create it."""
+    app = Flask(__name__)
+    app.config.from_object(config)
+    
+    # Initialize extensions
+    configure_database(app)
+    db.init_app(app)
+    init_instrumentation(app)
+    init_rendering(app)
+    login_manager.init_app(app)
+    init_inventory_state(app)
+    app.register_blueprint(bp)
+    return app
+
+def init_inventory_state(app):
+    """The app's shared version file, caches, change feed and report job pool"""
+    instance = app.instance_path
+    app.extensions['inventory'] = SimpleNamespace(
+        # Bumped after every product, location or movement write; caches are keyed on it
+        version=VersionFile(os.path.join(instance, 'inventory.version')),
+        # Bumped after any user change, so every worker's cached logged-in users are reloaded
+        user_version=VersionFile(os.path.join(instance, 'users.version')),
+        user_cache=TTLCache('users', maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL']),
+        dashboard_cache=TTLCache('dashboard', maxsize=8, ttl=app.config['DASHBOARD_CACHE_TTL']),
+        # Rendered PDF reports, keyed by inventory version so a download with no writes since is a file send
+        report_cache=FileCache('report_pdf', app.config['REPORT_CACHE_DIR'] or os.path.join(instance, 'report_cache'),
+                               max_bytes=app.config['REPORT_CACHE_MAX_BYTES'], suffix='.pdf'),
+        # Serialized /api/stock and /api/movements responses (and their ETags) for the current inventory version
+        stock_api_cache=TTLCache('stock_api', maxsize=app.config['STOCK_API_CACHE_SIZE'], ttl=3600),
+        # Newest balance changes for live pages; refreshed from the change_event table when the version moves
+        change_feed=ChangeFeed(size=app.config['CHANGE_FEED_BUFFER']),
+        # Velocity and reorder point of every (product, location) from demand_stat, for the current inventory version
+        demand_cache=TTLCache('demand', maxsize=1, ttl=3600),
+        # Rendered report, product and movement tables for the current inventory version
+        fragment_cache=TTLCache('fragments', maxsize=app.config['FRAGMENT_CACHE_SIZE'], ttl=3600,
+                                max_bytes=app.config['FRAGMENT_CACHE_MAX_BYTES'], sizeof=fragment_size),
+        report_jobs=ReportJobs(app.config['REPORT_DIR'] or os.path.join(instance, 'reports'),
+                               max_workers=app.config['REPORT_JOB_WORKERS'],
+                               max_age=app.config['REPORT_JOB_MAX_AGE'])
+    )
+
+def fragment_size(fragment):
+    """Characters of rendered HTML in a cached fragment (a Markup, or a tuple holding one)"""
+    parts = fragment if isinstance(fragment, tuple) else (fragment,)
+    return sum(len(part) for part in parts if isinstance(part, str))
+
+def _inventory_state(name):
+    return LocalProxy(lambda: getattr(current_app.extensions['inventory'], name))
+
+inventory_version = _inventory_state('version')
+dashboard_cache = _inventory_state('dashboard_cache')
+report_cache = _inventory_state('report_cache')
+stock_api_cache = _inventory_state('stock_api_cache')
+change_feed = _inventory_state('change_feed')
+demand_cache = _inventory_state('demand_cache')
+fragment_cache = _inventory_state('fragment_cache')
+report_jobs = _inventory_state('report_jobs')
+user_version = _inventory_state('user_version')
+user_cache = _inventory_state('user_cache')
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Runs on every logged-in request; served from the user cache without a query
+    return load_session_user(int(user_id), user_cache, user_version.read())
 
-# Create tables and default data
-with app.app_context():
-    db.create_all()
+def init_database():
+    """Apply pending migrations and create the default admin user if there is none"""
+    for version, description in upgrade():
+        print(f"✅ Migration {version} applied: {description}")
     
     # Create default admin user if not exists
     if not User.query.filter_by(username='admin').first():
@@ -34,20 +123,198 @@ with app.app_context():
         )
         db.session.add(admin)
         db.session.commit()
+        user_version.bump()
         print("✅ Default admin created: username='admin', password='admin123'")
 
+@bp.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply pending schema migrations"""
+    applied = upgrade()
+    for version, description in applied:
+        click.echo(f'Applied {version}: {description}')
+    click.echo(f'Database at version {current_version()}')
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the database and the default admin user (run once per deploy, before the workers start)"""
+    init_database()
+    click.echo(f'Database at version {current_version()}')
+
+@bp.cli.command('create-admin')
+@click.option('--username', prompt=True)
+@click.option('--email', prompt=True)
+@click.password_option()
+def create_admin_command(username, email, password):
+    """Add an admin user"""
+    if User.query.filter_by(username=username).first():
+        raise click.ClickException(f'User {username} already exists')
+    db.session.add(User(username=username, password=generate_password_hash(password), email=email, is_admin=True))
+    db.session.commit()
+    user_version.bump()
+    click.echo(f'Admin {username} created')
+
+@bp.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Show the SQLite plan of each hot movement query; fail on full table scans and sorts of every match"""
+    if db.engine.dialect.name != 'sqlite':
+        click.echo('Query plan check only supports SQLite')
+        return
+    failed = False
+    for name, plan, problem in check_query_plans():
+        failed = failed or problem is not None
+        click.echo(f"{name}: {problem or 'ok'}")
+        for line in plan:
+            click.echo(f'    {line}')
+    if failed:
+        raise SystemExit(1)
+
+@bp.cli.command('rebuild-balances')
+@click.option('--check', is_flag=True, help='Only report drift, do not rewrite the ledger.')
+def rebuild_balances_command(check):
+    """Recompute the stock balance ledger from the movement log"""
+    drift = verify_ledger() if check else rebuild_ledger()
+    if drift and not check:
+        record_changes((product_id, location_id) for product_id, location_id, have, want in drift)
+        db.session.commit()
+        inventory_version.bump()
+    for product_id, location_id, have, want in drift:
+        click.echo(f'{product_id} @ {location_id}: ledger={have} movements={want}')
+    if check:
+        click.echo(f'{len(drift)} balance(s) out of sync')
+        if drift:
+            raise SystemExit(1)
+    else:
+        click.echo(f'Ledger rebuilt, {len(drift)} balance(s) corrected')
+
+@bp.cli.command('check-balance-engines')
+def check_balance_engines_command():
+    """Compare every balance engine against the replay reference"""
+    expected = calculate_balance('replay')
+    failed = False
+    for engine in BALANCE_ENGINES:
+        result = calculate_balance(engine)
+        ok = result == expected
+        failed = failed or not ok
+        click.echo(f"{engine}: {'ok' if ok else 'MISMATCH'} ({len(result)} rows)")
+    if failed:
+        raise SystemExit(1)
+
+@bp.cli.command('import-movements')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=10000, show_default=True, help='Rows per transaction.')
+@click.option('--atomic', is_flag=True, help='Reject a whole batch if any row in it is invalid.')
+@click.option('--warm-cache', is_flag=True, help='Render the PDF report for the new inventory version afterwards.')
+def import_movements_command(path, batch_size, atomic, warm_cache):
+    """Bulk import movements from a CSV or JSON file"""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.json'):
+            rows = iter(parse_movements(f.read(), 'json'))
+        else:
+            rows = csv.DictReader(f)
+        imported = 0
+        offset = 0
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            result = import_movements(batch, atomic=atomic)
+            imported += result['imported']
+            for error in result['errors']:
+                click.echo(f"Row {offset + error['row'] + 1}: {error['error']}")
+            if result['imported']:
+                inventory_version.bump()
+            queue_low_stock_alerts(result['keys'], current_app.config)
+            offset += len(batch)
+    click.echo(f'Imported {imported} of {offset} movements')
+    if warm_cache:
+        path, version = cached_report_pdf()
+        click.echo(f'Report cached at version {version}')
+
+@bp.cli.command('warm-report-cache')
+@click.option('--as-of', multiple=True, help='Also render the report as of this date (YYYY-MM-DD); repeatable.')
+def warm_report_cache_command(as_of):
+    """Render the PDF report for the current inventory version so the next download is a cache hit"""
+    moments = {label: parse_as_of(label) for label in as_of}
+    for label, moment in moments.items():
+        if moment is None:
+            raise click.ClickException(f'Invalid date: {label}')
+    for label, moment in [(None, None)] + list(moments.items()):
+        path, version = cached_report_pdf(label, moment)
+        click.echo(f"Report{f' as of {label}' if label else ''} cached at version {version}: {path}")
+
+@bp.cli.command('generate-data')
+@click.option('--products', default=1000, show_default=True)
+@click.option('--locations', default=50, show_default=True)
+@click.option('--movements', default=100000, show_default=True)
+@click.option('--days', default=365, show_default=True, help='Spread the movements over this many days.')
+@click.option('--seed', default=42, show_default=True)
+def generate_data_command(products, locations, movements, days, seed):
+    """Fill an empty database with synthetic products, locations and movements (for benchmarks)"""
+    init_database()
+    if Product.query.first() or Location.query.first():
+        raise click.ClickException('The database already has products or locations; '
+                                   'point DATABASE_URL at an empty one.')
+    if products < 1 or locations < 1:
+        raise click.ClickException('Need at least one product and one location.')
+    
+    def progress(done, total):
+        click.echo(f'\r{done:,}/{total:,} movements', nl=False)
+    
+    generate_inventory(products, locations, movements, days=days, seed=seed, progress=progress)
+    record_reset()
+    refresh_demand(current_app.config)
+    db.session.commit()
+    invalidate_choices()
+    inventory_version.bump()
+    click.echo(f'\nGenerated {products:,} products, {locations:,} locations and {movements:,} movements')
+
+@bp.cli.command('refresh-demand')
+def refresh_demand_command():
+    """Recompute velocity and reorder points for every product and location (run daily from cron)"""
+    start = time.perf_counter()
+    refresh_demand(current_app.config)
+    db.session.commit()
+    inventory_version.bump()
+    elapsed = time.perf_counter() - start
+    click.echo(f'Demand refreshed for {DemandStat.query.count():,} product/location pairs in {elapsed:.1f}s')
+
+@bp.cli.command('take-snapshots')
+@click.option('--min-movements', type=int, default=None,
+              help='Movements needed since the last snapshot before taking another (1 = daily). '
+                   'Defaults to SNAPSHOT_MIN_MOVEMENTS.')
+def take_snapshots_command(min_movements):
+    """Checkpoint stock balances at past day boundaries for point-in-time reports (run daily from cron)"""
+    created = take_snapshots(min_movements or current_app.config['SNAPSHOT_MIN_MOVEMENTS'])
+    for snapshot in created:
+        click.echo(f'Snapshot {snapshot.snapshot_id} at {snapshot.taken_at:%Y-%m-%d %H:%M} '
+                   f'({snapshot.movement_count:,} movements since the previous one)')
+    click.echo(f'{len(created)} snapshot(s) taken')
+
+@bp.cli.command('compact-history')
+@click.option('--keep-days', type=int, default=None,
+              help='Keep this many days of movements in the live table. Defaults to MOVEMENT_HISTORY_DAYS.')
+def compact_history_command(keep_days):
+    """Archive old movements behind the newest snapshot older than --keep-days"""
+    keep_days = keep_days if keep_days is not None else current_app.config['MOVEMENT_HISTORY_DAYS']
+    snapshot, archived = compact_history(datetime.utcnow() - timedelta(days=keep_days))
+    if snapshot is None:
+        raise click.ClickException(f'No snapshot older than {keep_days} days; run take-snapshots first.')
+    if archived:
+        inventory_version.bump()
+    click.echo(f'Archived {archived:,} movements before {snapshot.taken_at:%Y-%m-%d %H:%M}')
+
 # ============= AUTHENTICATION ROUTES =============
 
-@app.route('/')
+@bp.route('/')
 def index():
     if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
-    return redirect(url_for('login'))
+        return redirect(url_for('main.dashboard'))
+    return redirect(url_for('main.login'))
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     
     form = LoginForm()
     if form.validate_on_submit():
@@ -55,46 +322,115 @@ def login():
         if user and check_password_hash(user.password, form.password.data):
             login_user(user)
             flash('Login successful!', 'success')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('main.dashboard'))
         else:
             flash('Invalid username or password', 'danger')
     
     return render_template('login.html', form=form)
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
     flash('You have been logged out', 'info')
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 # ============= DASHBOARD =============
 
-@app.route('/dashboard')
+def cached_fragment(key, render):
+    """render()'s result (a rendered table, plus anything read with it), from fragment_cache until the next write"""
+    # Read before rendering: a write racing the render can only make the cached
+    # fragment newer than its version, which costs one extra render, never a stale page
+    version = inventory_version.read() or inventory_version.bump()
+    fragment = fragment_cache.get(key, version)
+    if fragment is None:
+        fragment = render()
+        fragment_cache.set(key, fragment, version)
+    return fragment
+
+def render_fragment(template, **context):
+    """A partial template rendered to Markup, so the page including it doesn't escape it"""
+    return Markup(render_template(template, **context))
+
+def current_demand():
+    """Velocity and reorder point of every (product, location) with outbound demand, loaded once per version"""
+    version = inventory_version.read()
+    demand = demand_cache.get('demand', version)
+    if demand is None:
+        demand = load_demand()
+        demand_cache.set('demand', demand, version)
+    return demand
+
+@bp.route('/dashboard')
 @login_required
 def dashboard():
-    # Get statistics
-    total_products = Product.query.count()
-    total_locations = Location.query.count()
-    total_movements = ProductMovement.query.count()
-    
-    # Get low stock items
-    balance_data = calculate_balance()
-    low_stock_items = [item for item in balance_data if item['qty'] <= app.config['LOW_STOCK_THRESHOLD']]
+    # Statistics and low stock items are cached until the next inventory write (or the TTL)
+    version = inventory_version.read()
+    stats = dashboard_cache.get('stats', version)
+    if stats is None:
+        # Read before the balances, so live updates resume from here without missing any
+        change_seq = current_seq()
+        threshold = current_app.config['LOW_STOCK_THRESHOLD']
+        demand = current_demand()
+        balance_data = with_demand(calculate_balance(), demand, threshold)
+        stats = {
+            'change_seq': change_seq,
+            'total_products': Product.query.count(),
+            'total_locations': Location.query.count(),
+            'total_movements': ProductMovement.query.count(),
+            'low_stock_items': [item for item in balance_data if item['low']],
+            'max_reorder_point': max(threshold, max((point for _, point in demand.values()), default=0))
+        }
+        dashboard_cache.set('stats', stats, version)
     
-    # Recent movements
-    recent_movements = ProductMovement.query.order_by(ProductMovement.timestamp.desc()).limit(5).all()
-    
-    return render_template('dashboard.html', 
-                         total_products=total_products,
-                         total_locations=total_locations,
-                         total_movements=total_movements,
-                         low_stock_items=low_stock_items,
-                         recent_movements=recent_movements)
+    return render_template('dashboard.html', recent_movements=recent_movements(), **stats)
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Per-endpoint request, SQL and render metrics of this worker (Prometheus text format)"""
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/api/cache/stats')
+@login_required
+def cache_stats():
+    """Hit/miss counters of this worker's caches"""
+    return {'inventory_version': inventory_version.read(), 'caches': [dashboard_cache.stats(), report_cache.stats(),
+                                                                     stock_api_cache.stats(), user_cache.stats(),
+                                                                     demand_cache.stats(), fragment_cache.stats()],
+            'change_feed': change_feed.stats()}
 
 # ============= PRODUCT ROUTES =============
 
-@app.route('/products', methods=['GET', 'POST'])
+def listing_args(*names, position=True):
+    """The search and sort arguments of a listing page, plus its cursor unless position=False,
+    so links and redirects can come back to the same page"""
+    names += ('sort', 'cursor', 'dir') if position else ('sort',)
+    return {name: request.args[name] for name in names if request.args.get(name)}
+
+def product_listing():
+    per_page = min(request.args.get('per_page', current_app.config['CATALOG_PER_PAGE'], type=int), 200)
+    return products_page(
+        q=request.args.get('q'),
+        category=request.args.get('category'),
+        sort=request.args.get('sort'),
+        cursor=request.args.get('cursor'),
+        direction=request.args.get('dir', 'next'),
+        per_page=max(per_page, 1)
+    )
+
+def product_table():
+    """Product list and pagination for this request's search, sort and position"""
+    def render():
+        page = product_listing()
+        return render_fragment('product_table.html', products=page.items, page=page,
+                               filter_args=listing_args('q', 'category', position=False),
+                               list_args=listing_args('q', 'category'))
+    return cached_fragment(('products', request.query_string), render)
+
+@bp.route('/products', methods=['GET', 'POST'])
 @login_required
 def products():
     form = ProductForm()
@@ -113,13 +449,24 @@ def products():
             )
             db.session.add(product)
             db.session.commit()
+            invalidate_choices()
+            inventory_version.bump()
             flash(f'Product {product.name} added successfully!', 'success')
-            return redirect(url_for('products'))
+            return redirect(url_for('main.products'))
     
-    all_products = Product.query.order_by(Product.created_at.desc()).all()
-    return render_template('products.html', form=form, products=all_products)
+    return render_template('products.html', form=form, product_table=product_table(),
+                           filter_args=listing_args('q', 'category', position=False),
+                           list_args=listing_args('q', 'category'))
+
+@bp.route('/api/products')
+@login_required
+def products_api():
+    """JSON variant of the product listing: same q, category, sort, cursor and dir arguments"""
+    page = product_listing()
+    return {'items': [product_dict(p) for p in page.items], 'total': page.total,
+            'prev_cursor': page.prev_cursor, 'next_cursor': page.next_cursor}
 
-@app.route('/products/edit/<product_id>', methods=['GET', 'POST'])
+@bp.route('/products/edit/<product_id>', methods=['GET', 'POST'])
 @login_required
 def edit_product(product_id):
     product = Product.query.get_or_404(product_id)
@@ -130,27 +477,51 @@ def edit_product(product_id):
         product.category = form.category.data
         product.description = form.description.data
         db.session.commit()
+        invalidate_choices()
+        inventory_version.bump()
         flash(f'Product {product.name} updated successfully!', 'success')
-        return redirect(url_for('products'))
+        return redirect(url_for('main.products', **listing_args('q', 'category')))
     
-    return render_template('products.html', form=form, products=Product.query.all(), editing=product)
+    # Show the page of the listing the edit was opened from, not the whole catalog
+    return render_template('products.html', form=form, product_table=product_table(), editing=product,
+                           filter_args=listing_args('q', 'category', position=False),
+                           list_args=listing_args('q', 'category'))
+
+def delete_stock_rows(**key):
+    """Delete the balance, alert and demand rows of a product or location about to be deleted"""
+    # Left behind, an alert row would count as already sent for a new product or location with the same ID
+    for model in (StockBalance, LowStockAlert, DemandStat):
+        model.query.filter_by(**key).delete()
 
-@app.route('/products/delete/<product_id>')
+@bp.route('/products/delete/<product_id>')
 @login_required
 def delete_product(product_id):
     product = Product.query.get_or_404(product_id)
     # Check if product has movements
-    if product.movements:
+    if product_has_movements(product_id):
         flash('Cannot delete product with existing movements!', 'danger')
     else:
+        delete_stock_rows(product_id=product_id)
         db.session.delete(product)
         db.session.commit()
+        invalidate_choices()
+        inventory_version.bump()
         flash('Product deleted successfully!', 'success')
-    return redirect(url_for('products'))
+    return redirect(url_for('main.products', **listing_args('q', 'category')))
 
 # ============= LOCATION ROUTES =============
 
-@app.route('/locations', methods=['GET', 'POST'])
+def location_listing():
+    per_page = min(request.args.get('per_page', current_app.config['CATALOG_PER_PAGE'], type=int), 200)
+    return locations_page(
+        q=request.args.get('q'),
+        sort=request.args.get('sort'),
+        cursor=request.args.get('cursor'),
+        direction=request.args.get('dir', 'next'),
+        per_page=max(per_page, 1)
+    )
+
+@bp.route('/locations', methods=['GET', 'POST'])
 @login_required
 def locations():
     form = LocationForm()
@@ -167,13 +538,25 @@ def locations():
             )
             db.session.add(location)
             db.session.commit()
+            invalidate_choices()
+            inventory_version.bump()
             flash(f'Location {location.name} added successfully!', 'success')
-            return redirect(url_for('locations'))
+            return redirect(url_for('main.locations'))
     
-    all_locations = Location.query.order_by(Location.created_at.desc()).all()
-    return render_template('locations.html', form=form, locations=all_locations)
+    page = location_listing()
+    return render_template('locations.html', form=form, locations=page.items, page=page,
+                           filter_args=listing_args('q', position=False),
+                           list_args=listing_args('q'))
+
+@bp.route('/api/locations')
+@login_required
+def locations_api():
+    """JSON variant of the location listing: same q, sort, cursor and dir arguments"""
+    page = location_listing()
+    return {'items': [location_dict(l) for l in page.items], 'total': page.total,
+            'prev_cursor': page.prev_cursor, 'next_cursor': page.next_cursor}
 
-@app.route('/locations/edit/<location_id>', methods=['GET', 'POST'])
+@bp.route('/locations/edit/<location_id>', methods=['GET', 'POST'])
 @login_required
 def edit_location(location_id):
     location = Location.query.get_or_404(location_id)
@@ -183,36 +566,47 @@ def edit_location(location_id):
         location.name = form.name.data
         location.address = form.address.data
         db.session.commit()
+        invalidate_choices()
+        inventory_version.bump()
         flash(f'Location {location.name} updated successfully!', 'success')
-        return redirect(url_for('locations'))
+        return redirect(url_for('main.locations', **listing_args('q')))
     
-    return render_template('locations.html', form=form, locations=Location.query.all(), editing=location)
+    # Show the page of the listing the edit was opened from, not every location
+    page = location_listing()
+    return render_template('locations.html', form=form, locations=page.items, page=page, editing=location,
+                           filter_args=listing_args('q', position=False),
+                           list_args=listing_args('q'))
 
-@app.route('/locations/delete/<location_id>')
+@bp.route('/locations/delete/<location_id>')
 @login_required
 def delete_location(location_id):
     location = Location.query.get_or_404(location_id)
-    if location.incoming_movements or location.outgoing_movements:
+    if location_has_movements(location_id):
         flash('Cannot delete location with existing movements!', 'danger')
     else:
+        delete_stock_rows(location_id=location_id)
         db.session.delete(location)
         db.session.commit()
+        invalidate_choices()
+        inventory_version.bump()
         flash('Location deleted successfully!', 'success')
-    return redirect(url_for('locations'))
+    return redirect(url_for('main.locations', **listing_args('q')))
 
 # ============= MOVEMENT ROUTES =============
 
-@app.route('/movements', methods=['GET', 'POST'])
+@bp.route('/movements', methods=['GET', 'POST'])
 @login_required
 def movements():
     form = MovementForm()
     
-    # Populate dropdown choices
-    products = Product.query.all()
-    locations = Location.query.all()
-    form.product_id.choices = [(p.product_id, f"{p.product_id} - {p.name}") for p in products]
-    form.from_location.choices = [('', 'None (New Stock)')] + [(l.location_id, l.name) for l in locations]
-    form.to_location.choices = [('', 'None (Remove Stock)')] + [(l.location_id, l.name) for l in locations]
+    # Populate dropdown choices (cached until a product or location changes)
+    ttl = current_app.config['CHOICES_CACHE_TTL']
+    locations = location_choices(ttl)
+    form.product_id.choices = product_choices(ttl)
+    form.from_location.choices = [('', 'None (New Stock)')] + locations
+    form.to_location.choices = [('', 'None (Remove Stock)')] + locations
+    # Big catalogs get a search box instead of a <select> with every product
+    product_autocomplete = len(form.product_id.choices) > current_app.config['PRODUCT_AUTOCOMPLETE_THRESHOLD']
     
     if form.validate_on_submit():
         # Validation: At least one location must be filled
@@ -229,91 +623,397 @@ def movements():
                 notes=form.notes.data
             )
             db.session.add(movement)
+            apply_movement(movement)
+            record_changes(touched_keys(movement))
+            refresh_demand(current_app.config, touched_keys(movement))
             db.session.commit()
+            inventory_version.bump()
+            change_feed.poke()
             
-            # Check for low stock and send alert
-            balance_data = calculate_balance()
-            for item in balance_data:
-                if item['qty'] <= app.config['LOW_STOCK_THRESHOLD']:
-                    send_low_stock_alert(
-                        item['product_name'],
-                        item['product_id'],
-                        item['location_name'],
-                        item['qty'],
-                        app.config['ADMIN_EMAIL'],
-                        app.config
-                    )
+            # Check the touched locations for low stock; emails go out in the background
+            queue_low_stock_alerts(touched_keys(movement), current_app.config)
             
             flash('Movement recorded successfully!', 'success')
-            return redirect(url_for('movements'))
+            return redirect(url_for('main.movements'))
     
-    all_movements = ProductMovement.query.order_by(ProductMovement.timestamp.desc()).all()
-    return render_template('movements.html', form=form, movements=all_movements)
+    # Filters and keyset cursor come from the query string
+    filters = {
+        'product_id': request.args.get('product') or None,
+        'location_id': request.args.get('location') or None,
+        'date_from': parse_date(request.args.get('date_from')),
+        'date_to': parse_date(request.args.get('date_to'))
+    }
+    filter_args = {key: value for key, value in request.args.items()
+                   if key in ('product', 'location', 'date_from', 'date_to') and value}
+
+    def render_table():
+        page = movements_page(
+            cursor=request.args.get('cursor'),
+            direction=request.args.get('dir', 'older'),
+            per_page=current_app.config['MOVEMENTS_PER_PAGE'],
+            **filters
+        )
+        return render_fragment('movement_table.html', movements=page.items, page=page, filter_args=filter_args)
+
+    return render_template('movements.html', form=form, movement_table=cached_fragment(
+                               ('movements', request.query_string), render_table),
+                           filter_args=filter_args, locations=locations,
+                           product_autocomplete=product_autocomplete)
 
-@app.route('/movements/delete/<int:movement_id>')
+@bp.route('/movements/delete/<int:movement_id>')
 @login_required
 def delete_movement(movement_id):
     movement = ProductMovement.query.get_or_404(movement_id)
+    apply_movement(movement, sign=-1)
+    invalidate_snapshots(movement.timestamp)
     db.session.delete(movement)
+    record_changes(touched_keys(movement))
+    refresh_demand(current_app.config, touched_keys(movement))
     db.session.commit()
+    inventory_version.bump()
+    change_feed.poke()
+    queue_low_stock_alerts(touched_keys(movement), current_app.config)
     flash('Movement deleted successfully!', 'success')
-    return redirect(url_for('movements'))
+    return redirect(url_for('main.movements'))
+
+@bp.route('/api/movements/bulk', methods=['POST'])
+@login_required
+def bulk_movements():
+    """Import a batch of movements posted as JSON or CSV (Content-Type: text/csv)"""
+    fmt = 'csv' if request.mimetype == 'text/csv' else 'json'
+    try:
+        rows = parse_movements(request.get_data(as_text=True), fmt)
+    except ValueError as e:
+        return {'success': False, 'imported': 0, 'errors': [{'row': None, 'error': str(e)}]}, 400
+    
+    result = import_movements(rows, atomic=bool(request.args.get('atomic')))
+    if result['imported']:
+        inventory_version.bump()
+        change_feed.poke()
+    queue_low_stock_alerts(result['keys'], current_app.config)
+    return {
+        'success': not result['errors'],
+        'imported': result['imported'],
+        'errors': result['errors']
+    }, 200 if result['imported'] or not result['errors'] else 400
+
+@bp.route('/api/products/search')
+@login_required
+def product_search():
+    """Product autocomplete: prefix match on name or ID"""
+    limit = min(request.args.get('limit', 20, type=int), 200)
+    return {'results': search_products(request.args.get('q', ''), limit=max(limit, 1))}
 
 # ============= REPORT ROUTES =============
 
-@app.route('/report')
+def report_as_of():
+    """The ?as_of= of a report request (YYYY-MM-DD or an ISO datetime) as (label, moment), or (None, None) for current stock"""
+    label = request.args.get('as_of')
+    if not label:
+        return None, None
+    moment = parse_as_of(label)
+    if moment is None:
+        abort(400, 'as_of must be a date (YYYY-MM-DD) or an ISO datetime')
+    return label, moment
+
+@bp.route('/report')
 @login_required
 def report():
-    balance_data = calculate_balance()
-    return render_template('report.html', balance=balance_data)
+    as_of, moment = report_as_of()
 
-@app.route('/report/pdf')
+    def render_table():
+        # Read before the balances, so live updates resume from here without missing any
+        change_seq = None if moment else current_seq()
+        # Historical reports start from the nearest snapshot and replay only the movements after it
+        balance_data = balances_as_of(moment) if moment else calculate_balance()
+        # Demand figures are for now, so a historical report only flags stock under LOW_STOCK_THRESHOLD
+        balance_data = with_demand(balance_data, {} if moment else current_demand(),
+                                   current_app.config['LOW_STOCK_THRESHOLD'])
+        return change_seq, render_fragment('balance_table.html', balance=balance_data, as_of=as_of,
+                                           demand_window_days=current_app.config['DEMAND_WINDOW_DAYS'])
+
+    # The change sequence is cached with the table, so the live updates start where it was rendered
+    change_seq, balance_table = cached_fragment(('report', as_of), render_table)
+    return render_template('report.html', balance_table=balance_table, as_of=as_of, change_seq=change_seq)
+
+def cached_report_pdf(as_of=None, moment=None, build=True):
+    """(path, version) of the PDF report for the current inventory version, rendering it on a miss.
+
+    path is None on a miss when build is False.
+    """
+    version = inventory_version.read() or inventory_version.bump()
+    key = ('balance_report', version, as_of, current_app.config['REPORT_ROWS_PER_TABLE'])
+    path = report_cache.get(key)
+    if path is None and build:
+        balance_data = balances_as_of(moment) if moment else calculate_balance()
+        path = report_cache.put(key, lambda output: generate_report_pdf(
+            balance_data, output=output, rows_per_table=current_app.config['REPORT_ROWS_PER_TABLE'], as_of=as_of))
+    return path, version
+
+@bp.route('/report/pdf')
 @login_required
 def report_pdf():
-    balance_data = calculate_balance()
-    pdf_buffer = generate_report_pdf(balance_data)
+    as_of, moment = report_as_of()
+    # ?background=1 builds a PDF that isn't cached yet in the process pool instead of this worker
+    background = bool(request.args.get('background'))
+    path, version = cached_report_pdf(as_of, moment, build=not background)
+    if path is None:
+        balance_data = balances_as_of(moment) if moment else calculate_balance()
+        job_id = report_jobs.submit(balance_data, rows_per_table=current_app.config['REPORT_ROWS_PER_TABLE'], as_of=as_of)
+        return redirect(url_for('main.report_pdf_job', job_id=job_id))
+    
+    # The file name already hashes the version, and the version is the time of the last write,
+    # so If-None-Match / If-Modified-Since get a 304 until the inventory changes
+    response = send_file(
+        path,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=f'inventory_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf',
+        etag=os.path.basename(path)[:-len('.pdf')],
+        last_modified=datetime.fromtimestamp(version / 1e9, tz=timezone.utc),
+        conditional=True
+    )
+    response.cache_control.private = True
+    return response
+
+@bp.route('/report/pdf/jobs/<job_id>')
+@login_required
+def report_pdf_job(job_id):
+    """Download a background PDF report once it is ready"""
+    status = report_jobs.status(job_id)
+    if status is None:
+        abort(404)
+    if status != 'done':
+        return {'job_id': job_id, 'status': status}, 202 if status == 'pending' else 500
     return send_file(
-        pdf_buffer,
+        report_jobs.path(job_id),
         mimetype='application/pdf',
         as_attachment=True,
-        download_name=f'inventory_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+        download_name=f'inventory_report_{job_id}.pdf'
+    )
+
+@bp.route('/report/export.<fmt>')
+@login_required
+def report_export(fmt):
+    """Stream the balance report as CSV or NDJSON without building it in memory"""
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    generate, mimetype = EXPORT_FORMATS[fmt]
+    as_of, moment = report_as_of()
+    return Response(
+        stream_with_context(generate(balances_as_of(moment) if moment else iter_balances())),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=inventory_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{fmt}'}
     )
 
+# ============= STOCK READ API =============
+
+def versioned_json(key, build):
+    """JSON response for build() with an ETag, served from stock_api_cache until the next inventory write.
+
+    Repeated polls don't query at all until something is written. The ETag is a
+    hash of the body, so after a write a client sending If-None-Match still gets a
+    304 if the write didn't change what it is polling.
+    """
+    # Read before building: a write racing the build can only make the cached body
+    # newer than its version, which costs one extra rebuild, never a stale response
+    version = inventory_version.read() or inventory_version.bump()
+    cached = stock_api_cache.get(key, version)
+    if cached is None:
+        body = current_app.json.dumps(build())
+        cached = body, hashlib.sha1(body.encode()).hexdigest()[:20]
+        stock_api_cache.set(key, cached, version)
+    body, etag = cached
+    # Weak match: gzipped responses carry the ETag as W/"..." (see rendering.compress_response)
+    if request.method in ('GET', 'HEAD') and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def stock_keys():
+    """(product_id, location_id) pairs from ?keys=P1:L1,P2:L2 or a JSON body {"keys": [[P, L], ...]}"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        keys = data.get('keys') if isinstance(data, dict) else None
+        if not isinstance(keys, list):
+            abort(400, 'Expected {"keys": [[product_id, location_id], ...]}')
+        pairs = [tuple(key) if isinstance(key, list)
+                 else (key.get('product_id'), key.get('location_id')) if isinstance(key, dict)
+                 else () for key in keys]
+    else:
+        pairs = [tuple(key.split(':', 1)) for key in request.args.get('keys', '').split(',') if key]
+    if not all(len(pair) == 2 and all(isinstance(part, str) and part for part in pair) for pair in pairs):
+        abort(400, 'Each key needs a product_id and a location_id')
+    if len(pairs) > current_app.config['STOCK_API_MAX_KEYS']:
+        abort(400, f"At most {current_app.config['STOCK_API_MAX_KEYS']} keys per request")
+    return pairs
+
+@bp.route('/api/stock/products/<product_id>')
+@login_required
+def product_stock_api(product_id):
+    """Non-zero balances of one product at every location"""
+    def build():
+        if db.session.get(Product, product_id) is None:
+            abort(404)
+        balances = product_balances(product_id)
+        return {'product_id': product_id, 'total': sum(b['qty'] for b in balances), 'balances': balances}
+    return versioned_json(('product', product_id), build)
+
+@bp.route('/api/stock/locations/<location_id>')
+@login_required
+def location_stock_api(location_id):
+    """Non-zero balances of every product at one location"""
+    def build():
+        if db.session.get(Location, location_id) is None:
+            abort(404)
+        return {'location_id': location_id, 'balances': location_balances(location_id)}
+    return versioned_json(('location', location_id), build)
+
+@bp.route('/api/stock/batch', methods=['GET', 'POST'])
+@login_required
+def batch_stock_api():
+    """Balances of many (product, location) pairs at once, 0 where there is no stock"""
+    keys = stock_keys()
+    return versioned_json(('batch', tuple(keys)), lambda: {'balances': balances_for_keys(keys)})
+
+@bp.route('/api/movements')
+@login_required
+def movements_api():
+    """Movements with an ID above ?after=, oldest first; pass next_after back to continue.
+
+    Deleted movements are not reported here; clients that mirror the ledger should
+    also poll the balances.
+    """
+    after = request.args.get('after', 0, type=int)
+    limit = min(max(request.args.get('limit', 500, type=int), 1), 1000)
+    def build():
+        movements = movements_after(after, limit)
+        return {
+            'movements': [movement_dict(m) for m in movements],
+            'next_after': movements[-1].movement_id if movements else after,
+            'more': len(movements) == limit
+        }
+    return versioned_json(('movements', after, limit), build)
+
+# ============= LIVE CHANGE FEED =============
+
+@bp.route('/api/changes')
+@login_required
+def changes_poll():
+    """Long-poll for balance changes after ?since=<seq>, waiting up to ?timeout= seconds for one.
+
+    Without since, returns the current sequence number to start from. reset=true means
+    the client fell behind the retained history (or a bulk change happened) and should
+    reload.
+    """
+    since = request.args.get('since', type=int)
+    if since is None:
+        return {'events': [], 'last_seq': current_seq(), 'reset': False}
+    limit = current_app.config['CHANGE_POLL_TIMEOUT']
+    timeout = min(max(request.args.get('timeout', limit, type=float), 0), limit)
+    change_feed.watch(current_app._get_current_object(), inventory_version._get_current_object())
+    # Don't hold a pooled connection (and an open read transaction) while waiting
+    db.session.close()
+    events, reset = change_feed.wait(since, timeout)
+    return {'events': events, 'last_seq': events[-1]['seq'] if events else since,
+            'reset': reset or any(event.get('reset') for event in events)}
+
+@bp.route('/api/changes/stream')
+@login_required
+def changes_stream():
+    """Server-Sent Events: one "message" per balance change, "reset" when the page should reload.
+
+    Starts after Last-Event-ID (sent by reconnecting browsers), ?since= or the current
+    sequence number. Streams end after CHANGE_STREAM_SECONDS; EventSource reconnects.
+    """
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    if since is None:
+        since = current_seq()
+    change_feed.watch(current_app._get_current_object(), inventory_version._get_current_object())
+    db.session.close()
+    deadline = time.monotonic() + current_app.config['CHANGE_STREAM_SECONDS']
+
+    def stream(seq):
+        yield 'retry: 2000\n\n'
+        while time.monotonic() < deadline:
+            events, reset = change_feed.wait(seq, min(15, max(deadline - time.monotonic(), 0)))
+            db.session.close()
+            if reset:
+                yield 'event: reset\ndata: {}\n\n'
+                return
+            for event in events:
+                seq = event['seq']
+                kind = 'event: reset\n' if event.get('reset') else ''
+                yield f'id: {seq}\n{kind}data: {current_app.json.dumps(event)}\n\n'
+            if not events:
+                # Comment line; keeps proxies from closing an idle connection
+                yield ': keepalive\n\n'
+
+    return Response(stream_with_context(stream(since)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # ============= API ENDPOINT FOR BALANCE UPDATE =============
 
-@app.route('/api/update_balance', methods=['POST'])
+@bp.route('/api/update_balance', methods=['POST'])
 @login_required
 def update_balance():
-    """Quick balance adjustment endpoint"""
-    data = request.json
-    product_id = data.get('product_id')
-    location_id = data.get('location_id')
-    new_qty = data.get('qty')
-    
-    # Calculate current balance
-    current_balance = 0
-    movements = ProductMovement.query.filter_by(product_id=product_id).all()
+    """Quick balance adjustment endpoint.
+
+    Takes {"product_id", "location_id", "qty"}, or {"adjustments": [...]} of those to
+    set many balances in one transaction.
+    """
+    data = request.get_json(silent=True) or {}
+    batch = 'adjustments' in data
+    adjustments = data['adjustments'] if batch else [data]
+    if not isinstance(adjustments, list):
+        return {'success': False, 'error': 'adjustments must be a list'}, 400
     
-    for m in movements:
-        if m.to_location == location_id:
-            current_balance += m.qty
-        if m.from_location == location_id:
-            current_balance -= m.qty
+    for item in adjustments:
+        if not isinstance(item, dict) or not isinstance(item.get('product_id'), str) or not item['product_id'] \
+                or not isinstance(item.get('location_id'), str) or not item['location_id'] \
+                or type(item.get('qty')) is not int or item['qty'] < 0:
+            return {'success': False, 'error': 'Each adjustment needs product_id, location_id and a qty >= 0',
+                    'item': item}, 400
+    missing_products, missing_locations = unknown_ids([item['product_id'] for item in adjustments],
+                                                      [item['location_id'] for item in adjustments])
+    if missing_products or missing_locations:
+        return {'success': False, 'error': 'Unknown product or location',
+                'unknown_products': missing_products, 'unknown_locations': missing_locations}, 400
     
-    # Create adjustment movement
-    adjustment = new_qty - current_balance
-    if adjustment != 0:
-        movement = ProductMovement(
-            product_id=product_id,
-            to_location=location_id if adjustment > 0 else None,
-            from_location=location_id if adjustment < 0 else None,
-            qty=abs(adjustment),
-            notes=f"Balance adjustment to {new_qty}"
-        )
-        db.session.add(movement)
+    # Read each balance from the ledger and update it conditionally, so parallel edits can't lose updates
+    try:
+        movements = [set_balance(item['product_id'], item['location_id'], item['qty']) for item in adjustments]
+        keys = touched_keys(*[m for m in movements if m is not None])
+        record_changes(keys)
+        refresh_demand(current_app.config, keys)
         db.session.commit()
+    except BalanceConflict as e:
+        db.session.rollback()
+        return {'success': False, 'error': str(e)}, 409
+    
+    movements = [m for m in movements if m is not None]
+    if movements:
+        inventory_version.bump()
+        change_feed.poke()
+        queue_low_stock_alerts(touched_keys(*movements), current_app.config)
     
-    return {'success': True, 'new_balance': new_qty}
+    if batch:
+        return {'success': True, 'results': [
+            {'product_id': item['product_id'], 'location_id': item['location_id'], 'new_balance': item['qty']}
+            for item in adjustments
+        ]}
+    return {'success': True, 'new_balance': adjustments[0]['qty']}
+
+app = create_app()
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # The development server sets up the database itself; deployments run init-db
+    with app.app_context():
+        init_database()
+    app.run(debug=True)
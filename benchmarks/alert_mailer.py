@@ -0,0 +1,141 @@
+"""Low stock alert emails through AlertMailer against a local SMTP stand-in.
+
+Usage: python benchmarks/alert_mailer.py [--items 5] [--digest-max-items 3] [--digest-window 0.5]
+
+Starts a minimal SMTP server on localhost (no TLS, no auth, like MAIL_USE_TLS=False
+against a debugging server) that keeps every message it receives, then queues
+--items alerts at once. They must arrive as digests of at most --digest-max-items
+over a single pooled session. The server then drops the session and one more alert
+must still get through on a new one. Exits with status 1 if any check fails.
+"""
+import argparse
+import email
+import email.header
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from alerts import AlertMailer  # noqa: E402
+
+
+class SMTPSession(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: accepts every command and stores each message"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.sessions += 1
+        self.server.connections.add(self.connection)
+        self.reply('220 localhost SMTP stand-in')
+        data = None
+        for raw in self.rfile:
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            if data is not None:
+                if line == '.':
+                    self.server.messages.append(email.message_from_string('\n'.join(data)))
+                    data = None
+                    self.reply('250 OK')
+                else:
+                    data.append(line[1:] if line.startswith('.') else line)
+                continue
+            command = line[:4].upper()
+            if command == 'DATA':
+                data = []
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('250 OK')
+        self.server.connections.discard(self.connection)
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPSession)
+        self.messages = []
+        self.sessions = 0
+        self.connections = set()
+
+    def drop_sessions(self):
+        """Close every open session from the server side, like an SMTP server timing out idle clients"""
+        for connection in list(self.connections):
+            connection.shutdown(socket.SHUT_RDWR)
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+def body_of(message):
+    return ''.join(part.get_payload(decode=True).decode() for part in message.walk() if not part.is_multipart())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=5, help='Alerts queued at once.')
+    parser.add_argument('--digest-max-items', type=int, default=3)
+    parser.add_argument('--digest-window', type=float, default=0.5, help='Seconds.')
+    args = parser.parse_args()
+
+    server = SMTPStandIn()
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    host, port = server.server_address
+    mailer = AlertMailer({
+        'MAIL_SERVER': host, 'MAIL_PORT': port, 'MAIL_USE_TLS': False,
+        'MAIL_USERNAME': 'alerts@localhost', 'MAIL_PASSWORD': None, 'ADMIN_EMAIL': 'admin@localhost',
+        'MAIL_DIGEST_WINDOW': args.digest_window, 'MAIL_DIGEST_MAX_ITEMS': args.digest_max_items,
+    })
+    items = [{'product_id': f'P{i:03d}', 'product_name': f'Product {i}', 'location_id': 'L1',
+              'location_name': 'Main Warehouse', 'qty': i} for i in range(args.items + 1)]
+    digests = -(-args.items // args.digest_max_items)
+
+    mailer.enqueue(items[:-1])
+    wait_for(lambda: len(server.messages) >= digests)
+    pooled_sessions = server.sessions
+    server.drop_sessions()
+    mailer.enqueue(items[-1:])
+    wait_for(lambda: len(server.messages) >= digests + 1)
+    mailer.stop()
+    server.shutdown()
+
+    failures = []
+    if len(server.messages) != digests + 1 or mailer.sent_digests != digests + 1:
+        failures.append(f'expected {digests + 1} emails, the server got {len(server.messages)} '
+                        f'and the mailer counted {mailer.sent_digests}')
+    if pooled_sessions != 1:
+        failures.append(f'the first {digests} digests used {pooled_sessions} SMTP sessions instead of one')
+    if server.sessions != 2:
+        failures.append(f'expected a second session after the server dropped the first, got {server.sessions} in all')
+    received = []
+    for message in server.messages:
+        body = body_of(message)
+        ids = [item['product_id'] for item in items if f"({item['product_id']})" in body]
+        received += ids
+        print(f"{message['To']}: {email.header.make_header(email.header.decode_header(message['Subject']))} "
+              f"({', '.join(ids)})")
+        if message['To'] != 'admin@localhost' or len(ids) > args.digest_max_items:
+            failures.append(f"bad digest to {message['To']} with {len(ids)} items")
+    if sorted(received) != [item['product_id'] for item in items]:
+        failures.append(f'expected each alert once, got {received}')
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    if failures:
+        sys.exit(1)
+    print(f'ok: {len(items)} alerts in {len(server.messages)} emails over {server.sessions} SMTP sessions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Thousands of concurrent clients polling the read-only stock API.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/bench.db flask --app app generate-data --products 10000 --locations 500 --movements 1000000
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/api_pollers.py --clients 2000 --duration 30
+
+Each client polls one product, location or batch URL every --interval seconds
+with If-None-Match, like a scanner or an ERP sync would, over a keep-alive
+connection when the server allows it. A writer posts to /api/update_balance every
+--write-interval seconds so the inventory version keeps moving and some polls get
+full responses.
+
+The app runs in a separate process on a local threaded WSGI server (werkzeug's,
+which closes the connection after each response), or pass --url to poll a server
+you started yourself, e.g. gunicorn with gthread workers. The clients are asyncio
+coroutines, so one process can keep thousands of them polling.
+"""
+import argparse
+import asyncio
+import http.cookiejar
+import json
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from load_test import percentile  # noqa: E402
+
+
+def raise_file_limit():
+    # Each client is a socket; the default soft limit is often 1024
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def serve(port):
+    import logging
+    from werkzeug.serving import make_server
+    from app import app
+    app.config.update(WTF_CSRF_ENABLED=False, MAIL_ALERTS_ENABLED=False, SLOW_REQUEST_MS=float('inf'))
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    # Room for every client to connect at once
+    server.socket.listen(4096)
+    server.serve_forever()
+
+
+def login(base_url):
+    """Log in once and return the session cookie header and some product and location IDs to poll"""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    for _ in range(100):
+        try:
+            opener.open(base_url + '/login', data=b'username=admin&password=admin123').read()
+            break
+        except OSError:
+            time.sleep(0.2)
+    cookie = '; '.join(f'{c.name}={c.value}' for c in jar)
+    products = json.load(opener.open(base_url + '/api/products?per_page=200'))['items']
+    locations = json.load(opener.open(base_url + '/api/locations?per_page=200'))['items']
+    return opener, cookie, [p['product_id'] for p in products], [l['location_id'] for l in locations]
+
+
+def poll_paths(products, locations, rng):
+    """A mix of the three kinds of poll: 60% per product, 30% per location, 10% batches of 20 pairs"""
+    kind = rng.random()
+    if kind < 0.6:
+        return f'/api/stock/products/{rng.choice(products)}'
+    if kind < 0.9:
+        return f'/api/stock/locations/{rng.choice(locations)}'
+    keys = ','.join(f'{rng.choice(products)}:{rng.choice(locations)}' for _ in range(20))
+    return f'/api/stock/batch?keys={keys}'
+
+
+async def read_response(reader):
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length:
+        await reader.readexactly(length)
+    return status, headers
+
+
+class Connection:
+    """One client's HTTP/1.1 connection, reopened when the server closes it"""
+
+    def __init__(self, host, port, cookie):
+        self.host, self.port, self.cookie = host, port, cookie
+        self.streams = None
+
+    async def request(self, path, etag=None, body=None):
+        if self.streams is None:
+            self.streams = await asyncio.open_connection(self.host, self.port)
+        reader, writer = self.streams
+        lines = [f"{'POST' if body else 'GET'} {path} HTTP/1.1", f'Host: {self.host}', f'Cookie: {self.cookie}']
+        if etag:
+            lines.append(f'If-None-Match: {etag}')
+        if body:
+            lines += ['Content-Type: application/json', f'Content-Length: {len(body)}']
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + (body or b''))
+        await writer.drain()
+        status, headers = await read_response(reader)
+        # Werkzeug's development server closes after every response; gunicorn and waitress keep the connection
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, headers
+
+    def close(self):
+        if self.streams is not None:
+            self.streams[1].close()
+            self.streams = None
+
+
+async def poller(stats, connection, path, interval, deadline, rng):
+    # Spread the first polls over one interval
+    await asyncio.sleep(rng.random() * interval)
+    etag = None
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status, headers = await connection.request(path, etag)
+            stats['latencies'].append(time.perf_counter() - start)
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            etag = headers.get('etag', etag)
+            await asyncio.sleep(interval * (0.5 + rng.random()))
+    except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+        stats['errors'] += 1
+    finally:
+        connection.close()
+
+
+async def writer_task(stats, connection, products, locations, interval, deadline, rng):
+    while time.perf_counter() < deadline:
+        body = json.dumps({'product_id': rng.choice(products), 'location_id': rng.choice(locations),
+                           'qty': rng.randint(0, 100)}).encode()
+        status, _ = await connection.request('/api/update_balance', body=body)
+        stats['writes'] += status == 200
+        await asyncio.sleep(interval)
+    connection.close()
+
+
+async def run(args, host, port, cookie, products, locations):
+    rng = random.Random(0)
+    stats = {'latencies': [], 'statuses': {}, 'errors': 0, 'writes': 0}
+    deadline = time.perf_counter() + args.duration
+    tasks = [poller(stats, Connection(host, port, cookie), poll_paths(products, locations, rng), args.interval,
+                    deadline, random.Random(i))
+             for i in range(args.clients)]
+    if args.write_interval:
+        tasks.append(writer_task(stats, Connection(host, port, cookie), products, locations, args.write_interval,
+                                 deadline, rng))
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    stats['wall'] = time.perf_counter() - start
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=2000, help='Concurrent polling clients.')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to poll for.')
+    parser.add_argument('--interval', type=float, default=2, help='Mean seconds between polls per client.')
+    parser.add_argument('--write-interval', type=float, default=1, help='Seconds between balance writes (0: none).')
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--url', help='Poll this server instead of starting one.')
+    parser.add_argument('--output', help='Write results to this JSON file.')
+    args = parser.parse_args()
+
+    raise_file_limit()
+    server = None
+    base_url = args.url or f'http://127.0.0.1:{args.port}'
+    if not args.url:
+        server = multiprocessing.Process(target=serve, args=(args.port,), daemon=True)
+        server.start()
+    try:
+        _, cookie, products, locations = login(base_url)
+        parts = urlsplit(base_url)
+        stats = asyncio.run(run(args, parts.hostname, parts.port or 80, cookie, products, locations))
+    finally:
+        if server:
+            server.terminate()
+
+    latencies, statuses = stats['latencies'], stats['statuses']
+    polls = len(latencies)
+    result = {
+        'clients': args.clients,
+        'polls': polls,
+        'throughput_rps': round(polls / stats['wall'], 1),
+        'not_modified_ratio': round(statuses.get(304, 0) / polls, 3) if polls else None,
+        'statuses': statuses,
+        'writes': stats['writes'],
+        'errors': stats['errors'],
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if polls else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2) if polls else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if polls else None,
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2) if polls else None,
+    }
+    for name, value in result.items():
+        print(f'{name:<20}{value}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Throughput of the bulk movement import into a scratch SQLite database.
+
+Usage: python benchmarks/bulk_import.py [--movements 100000] [--batch-size 10000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask  # noqa: E402
+from models import db, Product, Location  # noqa: E402
+from bulk import import_movements  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--movements', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--locations', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        db.init_app(app)
+
+        with app.app_context():
+            db.create_all()
+            db.session.add_all(Product(product_id=f'P{i}', name=f'Product {i}', category='Other')
+                               for i in range(args.products))
+            db.session.add_all(Location(location_id=f'L{i}', name=f'Location {i}')
+                               for i in range(args.locations))
+            db.session.commit()
+
+            rng = random.Random(42)
+            rows = []
+            for _ in range(args.movements):
+                source, target = rng.sample(range(args.locations), 2)
+                rows.append({
+                    'product_id': f'P{rng.randrange(args.products)}',
+                    'from_location': f'L{source}' if rng.random() < 0.7 else '',
+                    'to_location': f'L{target}',
+                    'qty': str(rng.randint(1, 20))
+                })
+
+            start = time.perf_counter()
+            imported = 0
+            for offset in range(0, len(rows), args.batch_size):
+                imported += import_movements(rows[offset:offset + args.batch_size])['imported']
+            elapsed = time.perf_counter() - start
+
+    print(f'Imported {imported} movements in {elapsed:.2f}s ({imported / elapsed:,.0f} movements/sec)')
+
+
+if __name__ == '__main__':
+    main()
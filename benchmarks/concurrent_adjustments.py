@@ -0,0 +1,120 @@
+"""Parallel clients adjusting the same balances through /api/update_balance: no lost updates.
+
+Usage: python benchmarks/concurrent_adjustments.py [--clients 8] [--adjustments 200] [--pairs 3]
+
+Runs against a fresh SQLite database in a temporary directory. Each client thread
+logs in and keeps setting random quantities on a few shared (product, location)
+pairs, single and batched, including pairs that have no balance row yet. Afterwards
+every ledger balance must equal the sum of the movement log (each adjustment's
+movement was computed from the balance it replaced) and be a quantity some client
+set. Exits with status 1 on a lost update or on any response other than 200 or 409.
+A "database is locked" error (a writer that waited longer than busy_timeout) rolls
+the request back, so it is counted separately rather than failing the check.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+
+def client_run(app, pairs, adjustments, seed, statuses, written, lock):
+    rng = random.Random(seed)
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    for _ in range(adjustments):
+        if rng.random() < 0.2:
+            items = [{'product_id': p, 'location_id': l, 'qty': rng.randint(0, 100)}
+                     for p, l in rng.sample(pairs, min(len(pairs), 2))]
+            payload = {'adjustments': items}
+        else:
+            product_id, location_id = rng.choice(pairs)
+            items = [{'product_id': product_id, 'location_id': location_id, 'qty': rng.randint(0, 100)}]
+            payload = items[0]
+        try:
+            status = client.post('/api/update_balance', json=payload).status_code
+        except OperationalError as e:
+            if 'database is locked' not in str(e):
+                raise
+            status = 'locked'
+        with lock:
+            statuses[status] += 1
+            if status == 200:
+                for item in items:
+                    written.setdefault((item['product_id'], item['location_id']), set()).add(item['qty'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--adjustments', type=int, default=200, help='Requests per client.')
+    parser.add_argument('--pairs', type=int, default=3, help='Shared (product, location) pairs the clients fight over.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(directory, 'inventory.db')
+        from app import create_app, init_database
+        from config import Config
+        from ledger import verify_ledger
+        from models import db, Product, Location, StockBalance
+
+        class CheckConfig(Config):
+            WTF_CSRF_ENABLED = False
+            MAIL_ALERTS_ENABLED = False
+            SLOW_REQUEST_MS = float('inf')
+            PROPAGATE_EXCEPTIONS = True
+
+        app = create_app(CheckConfig)
+        with app.app_context():
+            init_database()
+            db.session.add_all([Product(product_id=f'P{i}', name=f'Product {i}', category='Other')
+                                for i in range(args.pairs)])
+            db.session.add_all([Location(location_id='L1', name='Location 1'), Location(location_id='L2', name='Location 2')])
+            db.session.commit()
+        # Half the pairs start without a balance row, so the first writes race to create it
+        pairs = [(f'P{i}', 'L1' if i % 2 else 'L2') for i in range(args.pairs)]
+
+        statuses, written, lock = Counter(), {}, threading.Lock()
+        threads = [threading.Thread(target=client_run, args=(app, pairs, args.adjustments, seed, statuses, written, lock))
+                   for seed in range(args.clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        with app.app_context():
+            drift = verify_ledger()
+            final = {(b.product_id, b.location_id): b.qty for b in StockBalance.query.all()}
+            db.engine.dispose()
+
+    requests = sum(statuses.values())
+    print(f'{requests} requests from {args.clients} clients in {elapsed:.1f}s '
+          f'({requests / elapsed:.0f}/s): ' + ', '.join(f'{count} x {status}' for status, count in sorted(statuses.items(), key=str)))
+    failed = False
+    for product_id, location_id, have, want in drift:
+        print(f'LOST UPDATE: {product_id}@{location_id} ledger {have}, movement log {want}')
+        failed = True
+    for key, qty in sorted(final.items()):
+        if qty and qty not in written.get(key, ()):
+            print(f'LOST UPDATE: {key[0]}@{key[1]} ended at {qty}, which no client set')
+            failed = True
+    unexpected = {status: count for status, count in statuses.items() if status not in (200, 409, 'locked')}
+    if unexpected:
+        print(f'FAIL: unexpected responses {unexpected}')
+        failed = True
+    if failed:
+        sys.exit(1)
+    print('ok: every balance matches the movement log')
+
+
+if __name__ == '__main__':
+    main()
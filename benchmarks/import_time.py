@@ -0,0 +1,96 @@
+"""Import time of the app module, and a check that importing it stays cheap.
+
+Usage:
+    python benchmarks/import_time.py [--budget-ms 1500]
+    python benchmarks/import_time.py --output baseline.json   # later: --baseline baseline.json
+
+Imports app in fresh interpreters under `python -X importtime`, with DATABASE_URL
+pointing at a database that doesn't exist, so the import fails if it touches the
+database. Reports the fastest run and the slowest modules. Exits with status 1 if the
+import pulled in a module that should only load on first use (ReportLab, Pillow,
+smtplib, email, multiprocessing), or if it is slower than the budget: --budget-ms,
+or with --baseline the import time recorded by an earlier --output run on the same
+machine plus --margin. Single imports vary by a fifth or more between runs, so the
+default budget is about twice a typical import.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Only needed to build PDFs, send alert emails or run report jobs
+DEFERRED_MODULES = ['reportlab', 'PIL', 'smtplib', 'email.mime', 'multiprocessing']
+
+
+def import_once(database_url):
+    """(total microseconds, {module: cumulative microseconds}) for one `import app` in a new interpreter"""
+    env = dict(os.environ, DATABASE_URL=database_url)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode:
+        raise SystemExit(f'import app failed:\n{proc.stderr[-2000:]}')
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Indentation shows nesting; keep the first (outermost) import of each module
+        modules.setdefault(name.strip(), int(cumulative))
+    return modules['app'], modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='Imports to time; the fastest is reported.')
+    parser.add_argument('--budget-ms', type=float, default=1500, help='Fail if importing app takes longer.')
+    parser.add_argument('--baseline', help='JSON from an earlier --output run; the budget becomes its import time plus --margin.')
+    parser.add_argument('--margin', type=float, default=0.5, help='Allowed slowdown over --baseline, as a fraction.')
+    parser.add_argument('--top', type=int, default=10, help='Slowest modules to list.')
+    parser.add_argument('--output', help='Write results to this JSON file.')
+    args = parser.parse_args()
+
+    budget_ms = args.budget_ms
+    if args.baseline:
+        with open(args.baseline) as f:
+            budget_ms = json.load(f)['import_ms'] * (1 + args.margin)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Not created by the import; if anything connects, SQLite fails to open it
+        database_url = 'sqlite:///' + os.path.join(directory, 'missing', 'inventory.db')
+        runs = [import_once(database_url) for _ in range(args.runs)]
+
+    total, modules = min(runs, key=lambda run: run[0])
+    deferred = sorted(name for name in modules
+                      if any(name == prefix or name.startswith(prefix + '.') for prefix in DEFERRED_MODULES))
+    # Top-level packages only, so the list isn't every submodule of SQLAlchemy
+    slowest = sorted(((name, us) for name, us in modules.items() if '.' not in name and name != 'app'),
+                     key=lambda item: item[1], reverse=True)[:args.top]
+
+    result = {
+        'import_ms': round(total / 1000, 1),
+        'runs_ms': [round(run[0] / 1000, 1) for run in runs],
+        'budget_ms': round(budget_ms, 1),
+        'modules': len(modules),
+        'deferred_modules_imported': deferred,
+        'slowest': {name: round(us / 1000, 1) for name, us in slowest},
+    }
+    for name, value in result.items():
+        print(f'{name:<28}{value}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if deferred:
+        print(f'FAIL: importing app loaded {", ".join(deferred)}')
+        sys.exit(1)
+    if total / 1000 > budget_ms:
+        print(f'FAIL: importing app took {total / 1000:.0f}ms, over the {budget_ms:.0f}ms budget')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
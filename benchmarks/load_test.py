@@ -0,0 +1,199 @@
+"""Latency, throughput, memory and SQL counts for the main pages.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/bench.db flask --app app generate-data --products 10000 --locations 500 --movements 1000000
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/load_test.py --requests 200 --output results.json
+
+By default requests go through Flask's test client in this process. With --server
+the app is served by a local threaded WSGI server and --concurrency clients hit it
+over HTTP. SQL counts come from the Server-Timing header the app adds to every
+response. Results can be saved as JSON and compared between runs with --compare.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import re
+import resource
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+ENDPOINTS = ['/dashboard', '/movements', '/report', '/report/pdf', '/api/update_balance']
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if platform.system() == 'Darwin' else rss / 1024
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def balance_keys(app):
+    from models import StockBalance
+    with app.app_context():
+        return [(b.product_id, b.location_id) for b in StockBalance.query.limit(1000)]
+
+
+class TestClientDriver:
+    """Sends requests through the Flask test client, one at a time"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+
+    def request(self, path, payload=None):
+        if payload is None:
+            response = self.client.get(path)
+        else:
+            response = self.client.post(path, json=payload)
+        response.get_data()
+        return response.status_code, response.headers.get('Server-Timing', '')
+
+
+class HTTPDriver:
+    """Sends requests over HTTP to a local server; one logged-in session per thread"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.local = threading.local()
+
+    def _opener(self):
+        if not hasattr(self.local, 'opener'):
+            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+            data = 'username=admin&password=admin123'.encode()
+            opener.open(self.base_url + '/login', data=data).read()
+            self.local.opener = opener
+        return self.local.opener
+
+    def request(self, path, payload=None):
+        req = urllib.request.Request(self.base_url + path)
+        if payload is not None:
+            req.data = json.dumps(payload).encode()
+            req.add_header('Content-Type', 'application/json')
+        try:
+            with self._opener().open(req) as response:
+                response.read()
+                return response.status, response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get('Server-Timing', '')
+
+
+def run_endpoint(driver, path, count, concurrency, keys):
+    rng = random.Random(0)
+    latencies, queries, errors = [], [], 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        payload = None
+        if path == '/api/update_balance':
+            product_id, location_id = rng.choice(keys) if keys else ('', '')
+            payload = {'product_id': product_id, 'location_id': location_id, 'qty': rng.randint(0, 100)}
+        start = time.perf_counter()
+        status, timing = driver.request(path, payload)
+        elapsed = time.perf_counter() - start
+        match = QUERIES_RE.search(timing)
+        with lock:
+            latencies.append(elapsed)
+            if match:
+                queries.append(int(match.group(1)))
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(one, range(count)))
+    else:
+        for i in range(count):
+            one(i)
+    wall = time.perf_counter() - start
+
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput_rps': round(count / wall, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+        'sql_queries_mean': round(statistics.mean(queries), 1) if queries else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def compare(old_path, new_results):
+    with open(old_path) as f:
+        old = json.load(f)['endpoints']
+    print(f"\n{'endpoint':<22}{'p50 before':>12}{'p50 after':>12}{'p95 before':>12}{'p95 after':>12}")
+    for path, result in new_results.items():
+        if path in old:
+            print(f"{path:<22}{old[path]['p50_ms']:>12}{result['p50_ms']:>12}"
+                  f"{old[path]['p95_ms']:>12}{result['p95_ms']:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=100, help='Requests per endpoint.')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--server', action='store_true', help='Serve the app over HTTP and use real clients.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Parallel clients with --server.')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--output', help='Write results to this JSON file.')
+    parser.add_argument('--compare', help='Earlier results JSON to compare against.')
+    args = parser.parse_args()
+
+    from app import app
+    app.config.update(WTF_CSRF_ENABLED=False, MAIL_ALERTS_ENABLED=False, SLOW_REQUEST_MS=float('inf'))
+    keys = balance_keys(app)
+
+    if args.server:
+        import logging
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', args.port, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        driver, concurrency = HTTPDriver(f'http://127.0.0.1:{args.port}'), args.concurrency
+    else:
+        server, driver, concurrency = None, TestClientDriver(app), 1
+
+    results = {}
+    print(f"{'endpoint':<22}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'SQL':>7}{'RSS MB':>8}{'errors':>8}")
+    for path in args.endpoints.split(','):
+        result = results[path] = run_endpoint(driver, path, args.requests, concurrency, keys)
+        print(f"{path:<22}{result['throughput_rps']:>8}{result['p50_ms']:>9}{result['p95_ms']:>9}"
+              f"{result['p99_ms']:>9}{result['sql_queries_mean'] or '-':>7}{result['peak_rss_mb']:>8}{result['errors']:>8}")
+
+    if server:
+        server.shutdown()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'database': app.config['SQLALCHEMY_DATABASE_URI'],
+                    'mode': 'server' if args.server else 'test_client',
+                    'concurrency': concurrency,
+                    'python': platform.python_version(),
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                },
+                'endpoints': results
+            }, f, indent=2)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == '__main__':
+    main()
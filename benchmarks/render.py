@@ -0,0 +1,122 @@
+"""Render time and bytes on the wire of the big pages, with and without the rendering layer.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/bench.db flask --app app generate-data --products 5000 --locations 50 --movements 500000
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/render.py --requests 20
+
+"before" turns off the Jinja bytecode cache, the fragment cache and compression;
+"after" uses the defaults in rendering.py. Each mode runs in a fresh interpreter,
+so "first" includes compiling the templates (or loading them from the bytecode
+cache, which an earlier process filled, like a restarted worker finds it). "warm"
+is the median of --requests more requests with no writes in between, "write" the
+median when every request follows a write (a fragment cache miss), and "304"
+whether a request sending back the ETag got a 304.
+"""
+import argparse
+import gzip
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+PAGES = ['/report', '/products', '/movements']
+
+MODES = {
+    'before': {'JINJA_CACHE_DIR': False, 'FRAGMENT_CACHE_SIZE': 0, 'COMPRESS_LEVEL': 0},
+    'after': {},
+}
+
+
+def timed_get(client, path, headers):
+    start = time.perf_counter()
+    response = client.get(path, headers=headers)
+    return (time.perf_counter() - start) * 1000, response
+
+
+def run_mode(mode, requests, jinja_cache_dir):
+    """Results for each page in this process ({page: {...}}), for one mode"""
+    from app import create_app, inventory_version
+    from config import Config
+
+    class BenchConfig(Config):
+        WTF_CSRF_ENABLED = False
+        MAIL_ALERTS_ENABLED = False
+        SLOW_REQUEST_MS = float('inf')
+        JINJA_CACHE_DIR = jinja_cache_dir
+
+    for name, value in MODES[mode].items():
+        setattr(BenchConfig, name, value)
+    app = create_app(BenchConfig)
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    # Skip the flashed welcome message, so every page below renders the same way each time
+    client.get('/dashboard')
+    headers = {'Accept-Encoding': 'gzip'}
+
+    results = {}
+    for path in PAGES:
+        first, response = timed_get(client, path, headers)
+        warm = [timed_get(client, path, headers)[0] for _ in range(requests)]
+        write = []
+        for _ in range(requests):
+            with app.app_context():
+                inventory_version.bump()
+            write.append(timed_get(client, path, headers)[0])
+        response = client.get(path, headers=headers)
+        body = response.get_data()
+        revalidated = client.get(path, headers=dict(headers, **{'If-None-Match': response.headers.get('ETag', '')}))
+        results[path] = {
+            'first_ms': round(first, 1),
+            'warm_ms': round(statistics.median(warm), 1),
+            'write_ms': round(statistics.median(write), 1),
+            'html_bytes': len(gzip.decompress(body) if response.headers.get('Content-Encoding') == 'gzip' else body),
+            'wire_bytes': len(body),
+            'not_modified': revalidated.status_code == 304,
+        }
+    return results
+
+
+def run_in_subprocess(mode, requests, jinja_cache_dir):
+    proc = subprocess.run([sys.executable, __file__, '--worker', mode, '--requests', str(requests),
+                           '--jinja-cache-dir', jinja_cache_dir], cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode:
+        raise SystemExit(f'{mode} run failed:\n{proc.stderr[-2000:]}')
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20, help='Requests per page for the warm and write medians.')
+    parser.add_argument('--output', help='Write results to this JSON file.')
+    parser.add_argument('--worker', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--jinja-cache-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_mode(args.worker, args.requests, args.jinja_cache_dir)))
+        return
+
+    with tempfile.TemporaryDirectory() as jinja_cache_dir:
+        # Fill the bytecode cache first, as a previous worker would have
+        run_in_subprocess('after', 1, jinja_cache_dir)
+        results = {mode: run_in_subprocess(mode, args.requests, jinja_cache_dir) for mode in MODES}
+
+    print(f"{'page':<12}{'mode':<8}{'first ms':>10}{'warm ms':>10}{'write ms':>10}{'HTML KB':>10}{'wire KB':>10}{'304':>6}")
+    for path in PAGES:
+        for mode in MODES:
+            r = results[mode][path]
+            print(f"{path:<12}{mode:<8}{r['first_ms']:>10}{r['warm_ms']:>10}{r['write_ms']:>10}"
+                  f"{r['html_bytes'] / 1024:>10.1f}{r['wire_bytes'] / 1024:>10.1f}{'yes' if r['not_modified'] else 'no':>6}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
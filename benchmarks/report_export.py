@@ -0,0 +1,75 @@
+"""Time and peak memory of the report exports for synthetic balance tables.
+
+Usage: python benchmarks/report_export.py [--sizes 10000,100000,1000000] [--formats csv,ndjson,pdf]
+
+No database is needed: rows are generated on the fly, so the numbers cover
+only the export itself. Add "pdf-single" to --formats to compare against one
+big ReportLab table (slow; keep the sizes small).
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from exports import iter_csv, iter_ndjson  # noqa: E402
+from utils import generate_report_pdf  # noqa: E402
+
+
+def fake_balances(count):
+    for i in range(count):
+        yield {
+            'product_id': f'P{i:07}',
+            'product_name': f'Product {i}',
+            'location_id': f'L{i % 500:03}',
+            'location_name': f'Warehouse {i % 500}',
+            'qty': i % 97
+        }
+
+
+def run_stream(generate, count):
+    size = 0
+    for chunk in generate(fake_balances(count)):
+        size += len(chunk)
+    return size
+
+
+def run_pdf(count, rows_per_table):
+    return len(generate_report_pdf(fake_balances(count), rows_per_table=rows_per_table).getvalue())
+
+
+RUNNERS = {
+    'csv': lambda count: run_stream(iter_csv, count),
+    'ndjson': lambda count: run_stream(iter_ndjson, count),
+    'pdf': lambda count: run_pdf(count, 500),
+    'pdf-single': lambda count: run_pdf(count, count),
+}
+
+
+def measure(fmt, count):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = RUNNERS[fmt](count)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--formats', default='csv,ndjson,pdf')
+    args = parser.parse_args()
+
+    print(f"{'format':<12}{'rows':>10}{'seconds':>10}{'peak MB':>10}{'output MB':>11}")
+    for fmt in args.formats.split(','):
+        for count in (int(size) for size in args.sizes.split(',')):
+            elapsed, peak, size = measure(fmt, count)
+            print(f'{fmt:<12}{count:>10}{elapsed:>10.2f}{peak / 1e6:>10.1f}{size / 1e6:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
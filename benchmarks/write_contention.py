@@ -0,0 +1,112 @@
+"""Multi-process write contention on SQLite, default settings vs the tuned engine in database.py.
+
+Usage: python benchmarks/write_contention.py [--writers 4] [--readers 4] [--seconds 5]
+
+Each writer records movements one transaction at a time (movement insert plus ledger
+upsert, like the movement form), each reader keeps summing the ledger (like the
+dashboard). Reports committed writes/sec, reads/sec and "database is locked" errors.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+import database  # noqa: E402
+
+SCHEMA = [
+    'CREATE TABLE product_movement (movement_id INTEGER PRIMARY KEY, product_id TEXT, to_location TEXT, qty INTEGER)',
+    'CREATE TABLE stock_balance (product_id TEXT, location_id TEXT, qty INTEGER, PRIMARY KEY (product_id, location_id))',
+]
+
+
+def make_engine(url, tuned):
+    if not tuned:
+        # What the app used before: no pragmas, rollback journal, pysqlite's default lock timeout
+        database._sqlite_pragmas.clear()
+        return create_engine(url)
+    database._sqlite_pragmas.clear()
+    database._sqlite_pragmas.update(database.DEFAULT_SQLITE_PRAGMAS)
+    return create_engine(url, **database.engine_options(url, {}))
+
+
+def writer(url, tuned, seconds, worker_id, results):
+    engine = make_engine(url, tuned)
+    done = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        product = f'P{(done + worker_id) % 100}'
+        try:
+            with engine.begin() as conn:
+                conn.execute(text('INSERT INTO product_movement (product_id, to_location, qty) VALUES (:p, :l, 1)'),
+                             {'p': product, 'l': 'L1'})
+                conn.execute(text('INSERT INTO stock_balance VALUES (:p, :l, 1) '
+                                  'ON CONFLICT (product_id, location_id) DO UPDATE SET qty = qty + 1'),
+                             {'p': product, 'l': 'L1'})
+            done += 1
+        except OperationalError:
+            errors += 1
+    results.put(('write', done, errors))
+
+
+def reader(url, tuned, seconds, results):
+    engine = make_engine(url, tuned)
+    done = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('SELECT SUM(qty) FROM stock_balance')).scalar()
+            done += 1
+        except OperationalError:
+            errors += 1
+    results.put(('read', done, errors))
+
+
+def run(tuned, writers, readers, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        engine = make_engine(url, tuned)
+        with engine.begin() as conn:
+            for statement in SCHEMA:
+                conn.execute(text(statement))
+        engine.dispose()
+
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=writer, args=(url, tuned, seconds, i, results))
+                     for i in range(writers)]
+        processes += [multiprocessing.Process(target=reader, args=(url, tuned, seconds, results))
+                      for _ in range(readers)]
+        for process in processes:
+            process.start()
+        totals = {'write': [0, 0], 'read': [0, 0]}
+        for _ in processes:
+            kind, done, errors = results.get()
+            totals[kind][0] += done
+            totals[kind][1] += errors
+        for process in processes:
+            process.join()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{'engine':<10}{'writes/s':>10}{'write errors':>14}{'reads/s':>10}{'read errors':>13}")
+    for name, tuned in (('default', False), ('tuned', True)):
+        totals = run(tuned, args.writers, args.readers, args.seconds)
+        print(f"{name:<10}{totals['write'][0] / args.seconds:>10.0f}{totals['write'][1]:>14}"
+              f"{totals['read'][0] / args.seconds:>10.0f}{totals['read'][1]:>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from flask import current_app
+from models import db, Product, Location, ProductMovement
+from ledger import apply_deltas, movement_deltas
+from snapshots import history_horizon, invalidate_snapshots
+from changes import record_changes
+from analytics import refresh_demand
+
+MOVEMENT_FIELDS = ['product_id', 'from_location', 'to_location', 'qty', 'notes', 'timestamp']
+
+
+def parse_movements(text, fmt):
+    """Turn a CSV or JSON upload into a list of row dicts.
+
+    JSON may be a list of objects or {"movements": [...]}. Raises ValueError on a malformed upload.
+    """
+    if fmt == 'csv':
+        return list(csv.DictReader(io.StringIO(text)))
+    if fmt == 'json':
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get('movements')
+        if not isinstance(data, list):
+            raise ValueError('Expected a list of movements')
+        return data
+    raise ValueError(f'Unsupported format: {fmt}')
+
+
+def _clean(row, product_ids, location_ids, horizon=None):
+    """Validate one row. Returns (values, None) or (None, error message).
+
+    horizon is the compaction horizon; movements dated before it are rejected.
+    """
+    if not isinstance(row, dict):
+        return None, 'Row must be an object'
+
+    product_id = str(row.get('product_id') or '').strip()
+    from_location = str(row.get('from_location') or '').strip() or None
+    to_location = str(row.get('to_location') or '').strip() or None
+
+    if product_id not in product_ids:
+        return None, f'Unknown product: {product_id or "(empty)"}'
+    if not from_location and not to_location:
+        return None, 'Either from_location or to_location is required'
+    if from_location and from_location not in location_ids:
+        return None, f'Unknown location: {from_location}'
+    if to_location and to_location not in location_ids:
+        return None, f'Unknown location: {to_location}'
+    if from_location == to_location:
+        return None, 'From and To locations cannot be the same'
+
+    # Integers or integer strings only; int() alone would truncate 5.7 to 5 and turn true into 1
+    qty = row.get('qty')
+    if isinstance(qty, str):
+        try:
+            qty = int(qty)
+        except ValueError:
+            pass
+    if type(qty) is not int:
+        return None, f'Invalid quantity: {row.get("qty")}'
+    if qty <= 0:
+        return None, 'Quantity must be positive'
+
+    notes = str(row.get('notes') or '') or None
+    if notes and len(notes) > 200:
+        return None, 'Notes must be at most 200 characters'
+
+    timestamp = row.get('timestamp') or None
+    if timestamp:
+        try:
+            timestamp = datetime.fromisoformat(str(timestamp))
+            # Stored as naive UTC like every utcnow() timestamp, so convert offsets rather than drop them
+            if timestamp.tzinfo is not None:
+                timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        except (TypeError, ValueError, OverflowError):
+            return None, f'Invalid timestamp: {timestamp}'
+        if horizon and timestamp < horizon:
+            return None, f'Timestamp is before the archived history ({horizon:%Y-%m-%d %H:%M})'
+
+    return {
+        'product_id': product_id,
+        'from_location': from_location,
+        'to_location': to_location,
+        'qty': qty,
+        'notes': notes,
+        'timestamp': timestamp or datetime.utcnow()
+    }, None
+
+
+def import_movements(rows, atomic=False):
+    """Validate and insert a batch of movements in one transaction.
+
+    Product and location IDs are checked against sets loaded once for the whole batch,
+    valid rows go in with a single executemany INSERT, and the ledger gets one upsert
+    per touched (product, location). Invalid rows are reported and skipped, or with
+    atomic=True the whole batch is rejected.
+
+    Returns {'imported': count, 'errors': [{'row': index, 'error': message}], 'keys': touched keys}.
+    """
+    product_ids = {product_id for product_id, in db.session.query(Product.product_id)}
+    location_ids = {location_id for location_id, in db.session.query(Location.location_id)}
+    horizon = history_horizon()
+
+    values, errors, deltas = [], [], {}
+    for index, row in enumerate(rows):
+        clean, error = _clean(row, product_ids, location_ids, horizon)
+        if error:
+            errors.append({'row': index, 'error': error})
+            continue
+        values.append(clean)
+        movement_deltas(clean['product_id'], clean['from_location'], clean['to_location'], clean['qty'], deltas)
+
+    if not values or (atomic and errors):
+        return {'imported': 0, 'errors': errors, 'keys': set()}
+
+    try:
+        db.session.execute(ProductMovement.__table__.insert(), values)
+        apply_deltas(deltas)
+        # Backdated rows change history that later snapshots already summed up
+        invalidate_snapshots(min(value['timestamp'] for value in values))
+        record_changes(deltas)
+        # Demand only counts movements out, so only their keys need recomputing
+        refresh_demand(current_app.config, {(value['product_id'], value['from_location'])
+                                            for value in values if value['from_location']})
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return {'imported': len(values), 'errors': errors, 'keys': set(deltas)}
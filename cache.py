@@ -0,0 +1,214 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after ttl seconds.
+
+    Entries can be stored with a version; a get() with a different version is a
+    miss, so bumping a shared version invalidates every worker's copy at once, and
+    the first set() at a new version drops the entries left from older ones. With
+    max_bytes, sizeof(value) gives each entry's size and the least recently used
+    entries are dropped past it; a value bigger than max_bytes isn't stored.
+    """
+
+    def __init__(self, name, maxsize=128, ttl=60, max_bytes=None, sizeof=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._version = None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, entry_version, expires, _ = entry
+                if entry_version == version and expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, value, version=None):
+        size = self.sizeof(value) if self.sizeof else 0
+        with self._lock:
+            if version is not None and version != self._version:
+                for stale in [k for k, entry in self._data.items() if entry[1] != version]:
+                    self._remove(stale)
+                self._version = version
+            self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._data[key] = (value, version, time.monotonic() + self.ttl, size)
+            self.bytes += size
+            while len(self._data) > self.maxsize or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self._remove(next(iter(self._data)))
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[3]
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when key is None"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+                self.bytes = 0
+            else:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'name': self.name,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None
+            }
+            if self.max_bytes is not None:
+                stats.update(bytes=self.bytes, max_bytes=self.max_bytes)
+            return stats
+
+
+class VersionFile:
+    """A version number shared by all worker processes through a small file.
+
+    bump() after any write; caches compare read() against the version their entry
+    was built at. Versions only go up, and two workers bumping at once still end
+    up with different values because they are nanosecond timestamps.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._seen = None       # (inode, mtime) of the file last read, and its version
+        self._lock = threading.Lock()
+
+    def read(self):
+        # bump() always writes a new file, so an unchanged inode and mtime means an
+        # unchanged version and a stat() is all a read costs
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return 0
+        with self._lock:
+            if self._seen and self._seen[0] == (st.st_ino, st.st_mtime_ns):
+                return self._seen[1]
+        try:
+            with open(self.path) as f:
+                version = int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+        with self._lock:
+            self._seen = ((st.st_ino, st.st_mtime_ns), version)
+        return version
+
+    def bump(self):
+        version = max(self.read() + 1, time.time_ns())
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        partial = f'{self.path}.{os.getpid()}.{threading.get_ident()}'
+        with open(partial, 'w') as f:
+            f.write(str(version))
+        os.replace(partial, self.path)
+        return version
+
+
+class FileCache:
+    """Rendered files (e.g. PDF reports) on local disk, evicted least recently used first past max_bytes.
+
+    Entries are named by a hash of their key and written next to their final name
+    before being moved into place, so every worker process can serve what another
+    one built. get() refreshes an entry's mtime, which is what eviction orders by.
+    """
+
+    def __init__(self, name, directory, max_bytes, suffix=''):
+        self.name = name
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + self.suffix)
+
+    def get(self, key):
+        """Path of the cached file for key, or None"""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(self, key, write):
+        """Store the file write(path) renders for key, evict what no longer fits and return its path"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        partial = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+        try:
+            write(partial)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        self.evict(keep=path)
+        return path
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(self.suffix) and not entry.name.endswith('.part'):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def evict(self, keep=None):
+        """Remove the least recently used files until the rest fit in max_bytes (never keep)"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        entries = self._entries() if os.path.isdir(self.directory) else []
+        lookups = self.hits + self.misses
+        return {
+            'name': self.name,
+            'files': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None
+        }
@@ -0,0 +1,219 @@
+import base64
+import json
+import re
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import and_, func, inspect, or_, text, tuple_
+from models import db, Product, Location
+
+CatalogPage = namedtuple('CatalogPage', ['items', 'total', 'prev_cursor', 'next_cursor'])
+
+# Sort keys for the listings; each ends with the primary key so the order is total.
+# ix_product_name_lower_id, ix_product_category_name, ix_product_created_at_id and the
+# location equivalents cover them.
+PRODUCT_SORTS = {
+    'name': lambda: (func.lower(Product.name), Product.product_id),
+    'id': lambda: (Product.product_id,),
+    'category': lambda: (Product.category, func.lower(Product.name), Product.product_id),
+    'created': lambda: (Product.created_at, Product.product_id),
+}
+
+LOCATION_SORTS = {
+    'name': lambda: (func.lower(Location.name), Location.location_id),
+    'id': lambda: (Location.location_id,),
+    'created': lambda: (Location.created_at, Location.location_id),
+}
+
+# Full-text indexes built by migration 6 (SQLite FTS5). The primary key is stored
+# unindexed instead of mapping to product.rowid, which VACUUM may renumber.
+FTS_TABLES = {
+    'product': ('product_fts', 'product_id', ['name', 'category', 'description']),
+    'location': ('location_fts', 'location_id', ['name', 'address']),
+}
+
+_fts_available = {}
+
+
+def fts_statements(table):
+    """DDL for table's FTS5 index and the triggers that keep it in step with the table"""
+    fts, key, columns = FTS_TABLES[table]
+    names = ', '.join([key] + columns)
+    new_values = ', '.join(f'new.{name}' for name in [key] + columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({key} UNINDEXED, {', '.join(columns)}, "
+        f"tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}({names}) VALUES ({new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+        f"DELETE FROM {fts} WHERE {key} = old.{key}; END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE ON {table} BEGIN "
+        f"DELETE FROM {fts} WHERE {key} = old.{key}; "
+        f"INSERT INTO {fts}({names}) VALUES ({new_values}); END",
+        f"DELETE FROM {fts}",
+        f"INSERT INTO {fts}({names}) SELECT {names} FROM {table}",
+    ]
+
+
+def _has_fts(table):
+    fts = FTS_TABLES[table][0]
+    if fts not in _fts_available:
+        _fts_available[fts] = db.engine.dialect.name == 'sqlite' and inspect(db.engine).has_table(fts)
+    return _fts_available[fts]
+
+
+def _text_match(model, query):
+    """Rows whose text columns contain every word of query (as word prefixes with FTS5)"""
+    table = model.__tablename__
+    fts, key, columns = FTS_TABLES[table]
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    if _has_fts(table):
+        match = ' '.join(f'"{word}"*' for word in words)
+        return getattr(model, key).in_(
+            text(f'SELECT {key} FROM {fts} WHERE {fts} MATCH :match').bindparams(match=match)
+            .columns(model.__table__.c[key])
+        )
+    # Databases without FTS5: substring match, one word at a time
+    return and_(*[or_(*[func.lower(getattr(model, column)).contains(word.lower(), autoescape=True)
+                        for column in columns])
+                  for word in words])
+
+
+def search_filter(model, query):
+    """Match query against the primary key (prefix) and the full-text index"""
+    query = query.strip()
+    key = getattr(model, FTS_TABLES[model.__tablename__][1])
+    # A range instead of LIKE so the primary key index is used
+    conditions = [key.between(query, query + '\uffff')]
+    text_match = _text_match(model, query)
+    if text_match is not None:
+        conditions.append(text_match)
+    return or_(*conditions)
+
+
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, columns):
+    """Sort key values from a cursor, or None if it is malformed or from another sort"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(columns):
+            return None
+        return [datetime.fromisoformat(value) if isinstance(column.type, db.DateTime) and value else value
+                for column, value in zip(columns, values)]
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _keyset_query(query, columns, descending, position, backwards, per_page):
+    query = query.add_columns(*columns)
+    # Walking backwards flips the comparison and the order; the rows are reversed afterwards
+    reverse = descending != backwards
+    if position is not None:
+        key, bound = tuple_(*columns), tuple_(*position)
+        # SQLite won't seek an expression index like lower(name) on a row value comparison
+        # alone, so the first column gets its own bound for the index range
+        first = columns[0] <= position[0] if reverse else columns[0] >= position[0]
+        query = query.filter(first, key < bound if reverse else key > bound)
+    # Fetch one extra row to know whether there is another page in this direction
+    return query.order_by(*[column.desc() if reverse else column.asc() for column in columns]) \
+                .limit(per_page + 1)
+
+
+def keyset_page(query, columns, descending=False, cursor=None, direction='next', per_page=50):
+    """One page of query ordered by columns, using keyset pagination on the whole sort key.
+
+    Like movements_page(), cursors hold the sort key of the boundary row, so a page
+    costs the same wherever it is in the listing. total counts every matching row.
+    """
+    total = query.order_by(None).count()
+    position = decode_cursor(cursor, columns) if cursor else None
+    backwards = position is not None and direction == 'prev'
+
+    rows = _keyset_query(query, columns, descending, position, backwards, per_page).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = position is not None, more
+
+    return CatalogPage(
+        items=[row[0] for row in rows],
+        total=total,
+        prev_cursor=encode_cursor(rows[0][1:]) if rows and has_prev else None,
+        next_cursor=encode_cursor(rows[-1][1:]) if rows and has_next else None
+    )
+
+
+def _sort(sorts, sort, default):
+    """Sort columns and direction for a sort parameter like 'name' or '-created'"""
+    descending = sort.startswith('-')
+    name = sort.lstrip('-')
+    if name not in sorts:
+        return _sort(sorts, default, default)
+    return sorts[name](), descending
+
+
+def _products_query(q=None, category=None):
+    query = Product.query
+    if q and q.strip():
+        query = query.filter(search_filter(Product, q))
+    if category:
+        query = query.filter(Product.category == category)
+    return query
+
+
+def _locations_query(q=None):
+    query = Location.query
+    if q and q.strip():
+        query = query.filter(search_filter(Location, q))
+    return query
+
+
+def products_page(q=None, category=None, sort='-created', cursor=None, direction='next', per_page=50):
+    """A page of products matching the search, newest first by default"""
+    columns, descending = _sort(PRODUCT_SORTS, sort or '-created', '-created')
+    return keyset_page(_products_query(q, category), columns, descending, cursor, direction, per_page)
+
+
+def locations_page(q=None, sort='-created', cursor=None, direction='next', per_page=50):
+    """A page of locations matching the search, newest first by default"""
+    columns, descending = _sort(LOCATION_SORTS, sort or '-created', '-created')
+    return keyset_page(_locations_query(q), columns, descending, cursor, direction, per_page)
+
+
+def products_page_query(q=None, category=None, sort='-created', position=None, per_page=50):
+    """The statement products_page() runs for a page after position (for query plan checks)"""
+    columns, descending = _sort(PRODUCT_SORTS, sort, '-created')
+    return _keyset_query(_products_query(q, category), columns, descending, position, False, per_page).statement
+
+
+def locations_page_query(q=None, sort='-created', position=None, per_page=50):
+    """The statement locations_page() runs for a page after position (for query plan checks)"""
+    columns, descending = _sort(LOCATION_SORTS, sort, '-created')
+    return _keyset_query(_locations_query(q), columns, descending, position, False, per_page).statement
+
+
+def product_dict(product):
+    return {
+        'product_id': product.product_id,
+        'name': product.name,
+        'category': product.category,
+        'description': product.description,
+        'created_at': product.created_at.isoformat() if product.created_at else None
+    }
+
+
+def location_dict(location):
+    return {
+        'location_id': location.location_id,
+        'name': location.name,
+        'address': location.address,
+        'created_at': location.created_at.isoformat() if location.created_at else None
+    }
@@ -0,0 +1,158 @@
+import threading
+from collections import deque
+from flask import current_app
+from sqlalchemy import delete, func, insert, select
+from models import db, ChangeEvent, StockBalance
+from ledger import keys_filter
+
+
+def record_changes(keys):
+    """Add a change event with the new balance of each (product_id, location_id) in keys.
+
+    Runs in the caller's transaction, after the ledger update and before the commit,
+    so the events commit (or roll back) with the write, and get sequence numbers in
+    commit order since SQLite has one writer at a time. Writes touching more than
+    CHANGE_FEED_MAX_KEYS balances record a single reset event instead, which tells
+    clients to reload.
+    """
+    keys = list(keys)
+    if not keys:
+        return
+    if len(keys) > current_app.config.get('CHANGE_FEED_MAX_KEYS', 1000):
+        record_reset()
+        return
+    for i in range(0, len(keys), 400):
+        db.session.execute(insert(ChangeEvent).from_select(
+            ['product_id', 'location_id', 'qty'],
+            select(StockBalance.product_id, StockBalance.location_id, StockBalance.qty)
+            .where(keys_filter(keys[i:i + 400]))
+        ))
+    _prune()
+
+
+def record_reset():
+    """Add an event telling clients to reload everything (after imports, rebuilds and generated data)"""
+    db.session.add(ChangeEvent())
+    db.session.flush()
+    _prune()
+
+
+def _prune():
+    # Keep the newest CHANGE_FEED_RETENTION events; a primary key range delete, so cheap when there's nothing to do
+    retention = current_app.config.get('CHANGE_FEED_RETENTION', 100000)
+    newest = select(func.max(ChangeEvent.seq)).scalar_subquery()
+    db.session.execute(delete(ChangeEvent).where(ChangeEvent.seq <= newest - retention))
+
+
+def current_seq():
+    """Sequence number of the newest change event, 0 if there are none"""
+    return db.session.query(func.max(ChangeEvent.seq)).scalar() or 0
+
+
+def event_dict(event):
+    if event.product_id is None:
+        return {'seq': event.seq, 'reset': True}
+    return {'seq': event.seq, 'product_id': event.product_id, 'location_id': event.location_id,
+            'qty': event.qty, 'at': event.created_at.isoformat()}
+
+
+def events_after(seq, limit=1000):
+    """Up to limit events with a sequence number above seq, oldest first"""
+    return [event_dict(event) for event in
+            ChangeEvent.query.filter(ChangeEvent.seq > seq).order_by(ChangeEvent.seq).limit(limit)]
+
+
+class ChangeFeed:
+    """This worker's copy of the newest change events, for SSE and long-poll subscribers.
+
+    A ring buffer of the last `size` events, refreshed from the change_event table by
+    one thread per worker whenever the shared inventory version moves, so writes made
+    by any worker reach every worker's subscribers with one query per worker. Waiting
+    subscribers are woken through a condition variable.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.events = deque(maxlen=size)
+        self.last_seq = None
+        self._changed = threading.Condition()
+        self._refresh_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._watcher = None
+
+    def refresh(self):
+        """Load the events committed since the last refresh and wake the subscribers"""
+        with self._refresh_lock:
+            if self.last_seq is None:
+                # Start at the end; older events are read from the table on demand
+                rows, last_seq = [], current_seq()
+            else:
+                newest = ChangeEvent.query.filter(ChangeEvent.seq > self.last_seq) \
+                    .order_by(ChangeEvent.seq.desc()).limit(self.size).all()
+                rows = [event_dict(event) for event in reversed(newest)]
+                last_seq = rows[-1]['seq'] if rows else self.last_seq
+            with self._changed:
+                self.events.extend(rows)
+                self.last_seq = last_seq
+                self._changed.notify_all()
+
+    def since(self, seq):
+        """(events after seq, reset) where reset means seq is older than the retained history"""
+        with self._changed:
+            if self.last_seq is None or seq >= self.last_seq:
+                return [], False
+            if self.events and self.events[0]['seq'] <= seq + 1:
+                return [event for event in self.events if event['seq'] > seq], False
+        # Behind the buffer: read from the table, unless those events were pruned
+        oldest = db.session.query(func.min(ChangeEvent.seq)).scalar()
+        if oldest is None or seq < oldest - 1:
+            return [], True
+        return events_after(seq, self.size), False
+
+    def wait(self, seq, timeout):
+        """Block until there are events after seq or timeout seconds pass, then return since(seq)"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.last_seq is not None and self.last_seq > seq, timeout)
+        return self.since(seq)
+
+    def poke(self):
+        """Refresh now instead of at the next check (after a write in this worker)"""
+        self._wake.set()
+
+    def watch(self, app, version, interval=0.5):
+        """Start the refresh thread, which checks the version file every interval seconds (once per worker).
+
+        The first call also refreshes right away, in the caller's app context.
+        """
+        if self._watcher is not None:
+            return
+        self.refresh()
+        with self._refresh_lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._run, args=(app, version, interval),
+                                             name='change-feed', daemon=True)
+            self._watcher.start()
+
+    def _run(self, app, version, interval):
+        seen = object()
+        while True:
+            current = version.read()
+            if current != seen or self.last_seq is None:
+                try:
+                    with app.app_context():
+                        self.refresh()
+                    seen = current
+                except Exception:
+                    app.logger.exception('Change feed refresh failed')
+            self._wake.wait(interval)
+            self._wake.clear()
+
+    def stats(self):
+        with self._changed:
+            return {
+                'buffered': len(self.events),
+                'size': self.size,
+                'last_seq': self.last_seq,
+                'oldest_buffered': self.events[0]['seq'] if self.events else None
+            }
@@ -0,0 +1,60 @@
+import threading
+import time
+from sqlalchemy import func, or_
+from models import db, Product, Location
+
+# Choice lists for the movement form, rebuilt only after a product/location write.
+# Other worker processes can't see our invalidations, so entries also expire after a TTL.
+_cache = {'version': 0, 'built_at': 0, 'products': None, 'locations': None}
+_lock = threading.Lock()
+
+
+def invalidate_choices():
+    """Call after committing any product or location change"""
+    with _lock:
+        _cache['version'] += 1
+        _cache['products'] = None
+        _cache['locations'] = None
+
+
+def _load(ttl):
+    with _lock:
+        if _cache['products'] is not None and time.monotonic() - _cache['built_at'] < ttl:
+            return _cache
+        version = _cache['version']
+
+    products = [(product_id, f"{product_id} - {name}") for product_id, name in
+                db.session.query(Product.product_id, Product.name).order_by(Product.product_id)]
+    locations = [(location_id, name) for location_id, name in
+                 db.session.query(Location.location_id, Location.name).order_by(Location.name)]
+
+    with _lock:
+        # Don't store lists built from data that was changed while we were loading
+        if _cache['version'] == version:
+            _cache.update(built_at=time.monotonic(), products=products, locations=locations)
+    return {'version': version, 'products': products, 'locations': locations}
+
+
+def product_choices(ttl=60):
+    """(product_id, label) pairs for product select fields"""
+    return _load(ttl)['products']
+
+
+def location_choices(ttl=60):
+    """(location_id, name) pairs for location select fields"""
+    return _load(ttl)['locations']
+
+
+def search_products(query, limit=20):
+    """Products whose name (case-insensitive) or ID starts with query"""
+    query = query.strip()
+    if not query:
+        return []
+    # Ranges instead of LIKE, so SQLite can use the lower(name) index and the primary key
+    name_prefix = query.lower()
+    rows = db.session.query(Product.product_id, Product.name).filter(or_(
+        func.lower(Product.name).between(name_prefix, name_prefix + '\uffff'),
+        Product.product_id.between(query, query + '\uffff')
+    )).order_by(func.lower(Product.name)).limit(limit)
+    return [{'product_id': product_id, 'name': name, 'label': f"{product_id} - {name}"}
+            for product_id, name in rows]
@@ -0,0 +1,68 @@
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Applied to every new SQLite connection. WAL lets readers run alongside the single
+# writer, busy_timeout makes writers wait for the lock instead of failing with
+# "database is locked", and NORMAL sync is safe with WAL (a crash can lose the last
+# commits but never corrupts the file).
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,            # milliseconds
+    'cache_size': -64000,            # negative means KiB, so 64 MB per connection
+    'mmap_size': 268435456,          # 256 MB
+    'temp_store': 'MEMORY',
+}
+
+_sqlite_pragmas = {}
+
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not _sqlite_pragmas or not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in _sqlite_pragmas.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+
+def normalize_url(url):
+    """Accept the postgres:// scheme many hosts hand out; SQLAlchemy only knows postgresql://"""
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(url, config):
+    """SQLALCHEMY_ENGINE_OPTIONS suited to the database behind url"""
+    if url in ('sqlite://', 'sqlite:///:memory:'):
+        # Flask-SQLAlchemy gives in-memory databases a single shared connection
+        return {}
+    if url.startswith('sqlite'):
+        busy_timeout = (config.get('SQLITE_PRAGMAS') or DEFAULT_SQLITE_PRAGMAS).get('busy_timeout', 5000)
+        return {
+            'pool_size': config.get('DB_POOL_SIZE') or 5,
+            'max_overflow': config.get('DB_MAX_OVERFLOW') or 10,
+            # Seconds the driver waits on a locked database before PRAGMA busy_timeout is set
+            'connect_args': {'timeout': busy_timeout / 1000},
+        }
+    return {
+        'pool_size': config.get('DB_POOL_SIZE') or 10,
+        'max_overflow': config.get('DB_MAX_OVERFLOW') or 20,
+        'pool_timeout': 30,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+    }
+
+
+def configure_database(app):
+    """Fill in engine options and SQLite pragmas. Call before db.init_app(app)."""
+    url = normalize_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    if not app.config.get('SQLALCHEMY_ENGINE_OPTIONS'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url, app.config)
+    if url.startswith('sqlite'):
+        _sqlite_pragmas.clear()
+        _sqlite_pragmas.update(app.config.get('SQLITE_PRAGMAS') or DEFAULT_SQLITE_PRAGMAS)
@@ -0,0 +1,111 @@
+import random
+from datetime import datetime, timedelta
+from models import db, Product, Location, ProductMovement, StockBalance
+
+CATEGORIES = ['Laptop', 'Phone', 'Tablet', 'Accessories', 'Other']
+ADJECTIVES = ['Pro', 'Air', 'Max', 'Mini', 'Lite', 'Ultra', 'Plus', 'Neo', 'Edge', 'Core']
+
+
+def generate_inventory(products, locations, movements, days=365, hub_ratio=0.05, seed=42,
+                       batch_size=50000, progress=None):
+    """Fill an empty database with a synthetic catalog and movement history.
+
+    The first hub_ratio of locations are warehouses that receive new stock; the rest
+    are stores. Movements run in time order over the last `days` days and mix
+    receipts into warehouses (20%), transfers out of stocked locations (30%) and
+    removals such as sales (50%), never taking a location below zero. A few products
+    get most of the traffic. The ledger is written from the final balances.
+    progress(done, total) is called after each batch.
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+
+    db.session.execute(Product.__table__.insert(), [{
+        'product_id': f'P{i:06}',
+        'name': f'{CATEGORIES[i % len(CATEGORIES)]} {rng.choice(ADJECTIVES)} {i}',
+        'category': CATEGORIES[i % len(CATEGORIES)],
+        'description': None,
+        'created_at': now
+    } for i in range(products)])
+
+    hubs = max(1, int(locations * hub_ratio))
+    db.session.execute(Location.__table__.insert(), [{
+        'location_id': f'{"WH" if i < hubs else "ST"}{i:04}',
+        'name': f'{"Warehouse" if i < hubs else "Store"} {i}',
+        'address': None,
+        'created_at': now
+    } for i in range(locations)])
+    db.session.commit()
+
+    product_ids = [f'P{i:06}' for i in range(products)]
+    location_ids = [f'{"WH" if i < hubs else "ST"}{i:04}' for i in range(locations)]
+
+    stock = {}
+    stocked = []          # keys that may have stock; emptied ones are dropped lazily
+    start = now - timedelta(days=days)
+    step = timedelta(days=days) / max(movements, 1)
+    batch = []
+
+    for n in range(movements):
+        kind = rng.random()
+        key = None
+        while stocked and kind >= 0.2:
+            i = rng.randrange(len(stocked))
+            if stock[stocked[i]] > 0:
+                key = stocked[i]
+                break
+            stocked[i] = stocked[-1]
+            stocked.pop()
+
+        if key is None:
+            # Receipt into a warehouse; skew toward the first products so some sell much more than others
+            product_id = product_ids[int(products * rng.random() ** 3)]
+            key = (product_id, location_ids[rng.randrange(hubs)])
+            qty = rng.randint(20, 500)
+            from_location, to_location = None, key[1]
+        elif kind < 0.5 and locations > 1:
+            # Transfer to another location
+            qty = rng.randint(1, min(stock[key], 100))
+            target = location_ids[rng.randrange(locations)]
+            while target == key[1]:
+                target = location_ids[rng.randrange(locations)]
+            from_location, to_location = key[1], target
+        else:
+            qty = rng.randint(1, min(stock[key], 10))
+            from_location, to_location = key[1], None
+
+        product_id = key[0]
+        for location_id, delta in ((from_location, -qty), (to_location, qty)):
+            if location_id:
+                k = (product_id, location_id)
+                if k not in stock:
+                    stock[k] = 0
+                    stocked.append(k)
+                elif stock[k] == 0 and delta > 0:
+                    stocked.append(k)
+                stock[k] += delta
+
+        batch.append({
+            'timestamp': start + step * n,
+            'product_id': product_id,
+            'from_location': from_location,
+            'to_location': to_location,
+            'qty': qty,
+            'notes': None
+        })
+        if len(batch) == batch_size:
+            db.session.execute(ProductMovement.__table__.insert(), batch)
+            db.session.commit()
+            batch = []
+            if progress:
+                progress(n + 1, movements)
+
+    if batch:
+        db.session.execute(ProductMovement.__table__.insert(), batch)
+    balances = [{'product_id': product_id, 'location_id': location_id, 'qty': qty}
+                for (product_id, location_id), qty in stock.items() if qty]
+    if balances:
+        db.session.execute(StockBalance.__table__.insert(), balances)
+    db.session.commit()
+    if progress:
+        progress(movements, movements)
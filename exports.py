@@ -0,0 +1,110 @@
+import csv
+import io
+import json
+import os
+import time
+import uuid
+
+EXPORT_COLUMNS = ['product_id', 'product_name', 'location_id', 'location_name', 'qty']
+
+
+def iter_csv(balance_data, rows_per_chunk=1000):
+    """Stream balance rows as CSV text, yielding rows_per_chunk lines at a time"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for item in balance_data:
+        writer.writerow(item)
+        count += 1
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(balance_data, rows_per_chunk=1000):
+    """Stream balance rows as newline-delimited JSON"""
+    lines = []
+    for item in balance_data:
+        lines.append(json.dumps({key: item[key] for key in EXPORT_COLUMNS}))
+        if len(lines) == rows_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (iter_csv, 'text/csv'),
+    'ndjson': (iter_ndjson, 'application/x-ndjson'),
+}
+
+
+def _build_pdf(balance_data, directory, job_id, rows_per_table, as_of=None):
+    """Runs in a pool process: render the PDF next to its final name, then move it into place"""
+    from utils import generate_report_pdf
+    base = os.path.join(directory, job_id)
+    try:
+        generate_report_pdf(balance_data, output=base + '.part', rows_per_table=rows_per_table, as_of=as_of)
+        os.replace(base + '.part', base + '.pdf')
+    except Exception as e:
+        with open(base + '.failed', 'w') as f:
+            f.write(str(e))
+        raise
+    finally:
+        if os.path.exists(base + '.pending'):
+            os.remove(base + '.pending')
+
+
+class ReportJobs:
+    """PDF reports built in a background process pool.
+
+    Files in directory track each job: <job_id>.pending while it builds, then
+    <job_id>.pdf or <job_id>.failed, so any worker process can answer a status
+    check for a job another worker started. Each submit() removes the files of
+    jobs last touched more than max_age seconds ago.
+    """
+
+    def __init__(self, directory, max_workers=2, max_age=3600):
+        self.directory = directory
+        self.max_workers = max_workers
+        self.max_age = max_age
+        self._pool = None
+
+    def submit(self, balance_data, rows_per_table=500, as_of=None):
+        if self._pool is None:
+            # Imported on first use: multiprocessing is slow to import and most workers never build a PDF
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        os.makedirs(self.directory, exist_ok=True)
+        self.cleanup()
+        job_id = uuid.uuid4().hex
+        open(os.path.join(self.directory, job_id + '.pending'), 'w').close()
+        self._pool.submit(_build_pdf, list(balance_data), self.directory, job_id, rows_per_table, as_of)
+        return job_id
+
+    def cleanup(self):
+        """Remove job files older than max_age: downloaded or abandoned reports, failures, dead jobs"""
+        cutoff = time.time() - self.max_age
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def status(self, job_id):
+        """'done', 'failed', 'pending' or None for an unknown job"""
+        # Job ids are uuid hex, anything else can't name a file here
+        if not job_id.isalnum():
+            return None
+        for suffix, status in (('.pdf', 'done'), ('.failed', 'failed'), ('.pending', 'pending')):
+            if os.path.exists(os.path.join(self.directory, job_id + suffix)):
+                return status
+        return None
+
+    def path(self, job_id):
+        return os.path.join(self.directory, job_id + '.pdf')
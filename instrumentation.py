@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('inventory.slow_requests')
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+
+class EndpointMetrics:
+    """Per-endpoint request counters and histograms for this worker process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, seconds, queries, db_seconds, render_seconds):
+        with self._lock:
+            m = self._endpoints.get(endpoint)
+            if m is None:
+                m = self._endpoints[endpoint] = {
+                    'count': 0, 'seconds': 0.0, 'queries': 0, 'db_seconds': 0.0, 'render_seconds': 0.0,
+                    'latency_buckets': [0] * len(LATENCY_BUCKETS),
+                    'query_buckets': [0] * len(QUERY_COUNT_BUCKETS)
+                }
+            m['count'] += 1
+            m['seconds'] += seconds
+            m['queries'] += queries
+            m['db_seconds'] += db_seconds
+            m['render_seconds'] += render_seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    m['latency_buckets'][i] += 1
+            for i, bound in enumerate(QUERY_COUNT_BUCKETS):
+                if queries <= bound:
+                    m['query_buckets'][i] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: dict(m, latency_buckets=list(m['latency_buckets']),
+                                   query_buckets=list(m['query_buckets']))
+                    for endpoint, m in self._endpoints.items()}
+
+    def prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def histogram(name, help_text, key, buckets, sum_key):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for endpoint, m in sorted(snapshot.items()):
+                for bound, count in zip(buckets, m[key]):
+                    lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {m["count"]}')
+                lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {m[sum_key]}')
+                lines.append(f'{name}_count{{endpoint="{endpoint}"}} {m["count"]}')
+
+        def counter(name, help_text, key):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for endpoint, m in sorted(snapshot.items()):
+                lines.append(f'{name}{{endpoint="{endpoint}"}} {m[key]}')
+
+        snapshot = self.snapshot()
+        histogram('inventory_request_duration_seconds', 'Wall time per request.',
+                  'latency_buckets', LATENCY_BUCKETS, 'seconds')
+        histogram('inventory_request_sql_queries', 'SQL statements executed per request.',
+                  'query_buckets', QUERY_COUNT_BUCKETS, 'queries')
+        counter('inventory_request_db_seconds_total', 'Time spent in SQL statements.', 'db_seconds')
+        counter('inventory_request_render_seconds_total', 'Time spent rendering templates.', 'render_seconds')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = EndpointMetrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'perf' in g:
+        perf = g.perf
+        perf['queries'] += 1
+        perf['db_seconds'] += elapsed
+        perf['statements'].append((elapsed, statement))
+
+
+def _before_render(app, template, context, **extra):
+    if has_request_context() and 'perf' in g:
+        g.perf['render_start'].append(time.perf_counter())
+
+
+def _rendered(app, template, context, **extra):
+    if has_request_context() and 'perf' in g and g.perf['render_start']:
+        g.perf['render_seconds'] += time.perf_counter() - g.perf['render_start'].pop()
+
+
+def init_instrumentation(app):
+    """Time every request: SQL count and time, template render time and wall time.
+
+    Adds a Server-Timing header, feeds the per-endpoint histograms served by
+    metrics.prometheus() and logs requests slower than SLOW_REQUEST_MS together
+    with their slowest statements.
+    """
+    log_path = app.config.get('SLOW_REQUEST_LOG')
+    if log_path and not logger.handlers:
+        handler = logging.FileHandler(log_path)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+
+    @app.before_request
+    def _start_timer():
+        g.perf = {'start': time.perf_counter(), 'queries': 0, 'db_seconds': 0.0,
+                  'render_seconds': 0.0, 'render_start': [], 'statements': []}
+
+    @app.after_request
+    def _record_timing(response):
+        perf = g.pop('perf', None)
+        if perf is None:
+            return response
+        seconds = time.perf_counter() - perf['start']
+        endpoint = request.endpoint or 'unmatched'
+
+        response.headers['Server-Timing'] = ', '.join([
+            f'db;dur={perf["db_seconds"] * 1000:.1f};desc="{perf["queries"]} queries"',
+            f'render;dur={perf["render_seconds"] * 1000:.1f}',
+            f'total;dur={seconds * 1000:.1f}',
+        ])
+        metrics.record(endpoint, seconds, perf['queries'], perf['db_seconds'], perf['render_seconds'])
+
+        if seconds * 1000 >= app.config.get('SLOW_REQUEST_MS', 500):
+            slowest = sorted(perf['statements'], reverse=True)[:5]
+            logger.warning(
+                'Slow request %s %s (%s): %.0f ms, %d queries, %.0f ms in SQL, %.0f ms rendering%s',
+                request.method, request.full_path.rstrip('?'), endpoint, seconds * 1000,
+                perf['queries'], perf['db_seconds'] * 1000, perf['render_seconds'] * 1000,
+                ''.join(f'\n    {elapsed * 1000:.1f} ms  {" ".join(statement.split())[:500]}'
+                        for elapsed, statement in slowest)
+            )
+        return response
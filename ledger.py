@@ -0,0 +1,307 @@
+from sqlalchemy import and_, func, literal, or_, select, union_all
+from sqlalchemy.exc import IntegrityError
+from models import db, Product, Location, ProductMovement, StockBalance
+
+
+def apply_deltas(deltas):
+    """Add each delta to its (product, location) balance row, creating rows as needed.
+
+    deltas maps (product_id, location_id) to a signed quantity. All keys go to the
+    database in one executemany upsert.
+    """
+    params = [{'product_id': product_id, 'location_id': location_id, 'qty': delta}
+              for (product_id, location_id), delta in deltas.items() if location_id and delta]
+    if not params:
+        return
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(StockBalance)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['product_id', 'location_id'],
+            set_={'qty': StockBalance.qty + stmt.excluded.qty}
+        )
+        db.session.execute(stmt, params)
+        return
+
+    # Generic fallback for databases without an upsert
+    for row in params:
+        updated = StockBalance.query.filter_by(product_id=row['product_id'], location_id=row['location_id']) \
+            .update({StockBalance.qty: StockBalance.qty + row['qty']}, synchronize_session=False)
+        if not updated:
+            db.session.add(StockBalance(**row))
+
+
+def movement_deltas(product_id, from_location, to_location, qty, deltas=None):
+    """Add one movement's effect to a deltas dict (see apply_deltas)"""
+    deltas = {} if deltas is None else deltas
+    if from_location:
+        key = (product_id, from_location)
+        deltas[key] = deltas.get(key, 0) - qty
+    if to_location:
+        key = (product_id, to_location)
+        deltas[key] = deltas.get(key, 0) + qty
+    return deltas
+
+
+def apply_movement(movement, sign=1):
+    """Update the ledger for a movement (sign=-1 reverses it, e.g. on delete).
+
+    Runs in the caller's session, so the ledger commits together with the movement.
+    """
+    apply_deltas(movement_deltas(movement.product_id, movement.from_location,
+                                 movement.to_location, sign * movement.qty))
+
+
+def _insert_balance(**row):
+    """Insert a balance row unless one exists; True if this call created it.
+
+    An upsert that does nothing on conflict rather than a SAVEPOINT: pysqlite starts
+    the transaction lazily, so a savepoint opened first would commit the row on
+    release instead of leaving it in the caller's transaction.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(StockBalance).values(**row).on_conflict_do_nothing(index_elements=['product_id', 'location_id'])
+        return db.session.execute(stmt).rowcount == 1
+
+    # Generic fallback: a savepoint, so losing the race doesn't abort the whole transaction
+    try:
+        with db.session.begin_nested():
+            db.session.add(StockBalance(**row))
+    except IntegrityError:
+        return False
+    return True
+
+
+def unknown_ids(product_ids, location_ids):
+    """(product IDs, location IDs) among those given that don't exist, sorted; one query for both"""
+    product_ids, location_ids = set(product_ids), set(location_ids)
+    found = db.session.execute(union_all(
+        select(literal('product'), Product.product_id).where(Product.product_id.in_(product_ids)),
+        select(literal('location'), Location.location_id).where(Location.location_id.in_(location_ids))
+    ))
+    for kind, found_id in found:
+        (product_ids if kind == 'product' else location_ids).discard(found_id)
+    return sorted(product_ids), sorted(location_ids)
+
+
+class BalanceConflict(Exception):
+    """A balance kept changing under set_balance() until it ran out of attempts"""
+
+
+def set_balance(product_id, location_id, new_qty, attempts=10):
+    """Set one balance to new_qty and record the difference as an adjustment movement.
+
+    Reads the ledger row by primary key, then writes it back with a conditional
+    UPDATE ... WHERE qty = <what we read>. If another request changed the balance in
+    between, nothing is written and we re-read and try again, so concurrent
+    adjustments never overwrite each other. Runs in the caller's transaction and
+    returns the adjustment movement (None when the balance was already new_qty).
+    """
+    key = {'product_id': product_id, 'location_id': location_id}
+    for _ in range(attempts):
+        current = db.session.query(StockBalance.qty).filter_by(**key).scalar()
+        if current is None:
+            # No row yet: creating it is the conditional write
+            if not _insert_balance(qty=new_qty, **key):
+                continue
+            current = 0
+        elif current == new_qty:
+            return None
+        else:
+            updated = StockBalance.query.filter_by(qty=current, **key) \
+                .update({StockBalance.qty: new_qty}, synchronize_session=False)
+            if not updated:
+                continue
+
+        adjustment = new_qty - current
+        if not adjustment:
+            return None
+        movement = ProductMovement(
+            product_id=product_id,
+            to_location=location_id if adjustment > 0 else None,
+            from_location=location_id if adjustment < 0 else None,
+            qty=abs(adjustment),
+            notes=f"Balance adjustment to {new_qty}"
+        )
+        db.session.add(movement)
+        return movement
+    raise BalanceConflict(f'Balance of {product_id} at {location_id} kept changing, try again')
+
+
+def _balance_rows():
+    return db.session.query(
+        StockBalance.product_id,
+        Product.name,
+        StockBalance.location_id,
+        Location.name,
+        StockBalance.qty
+    ).join(Product, Product.product_id == StockBalance.product_id) \
+     .join(Location, Location.location_id == StockBalance.location_id) \
+     .filter(StockBalance.qty > 0) \
+     .order_by(Product.name, Location.name)
+
+
+def _as_item(row):
+    product_id, product_name, location_id, location_name, qty = row
+    return {
+        'product_id': product_id,
+        'product_name': product_name,
+        'location_id': location_id,
+        'location_name': location_name,
+        'qty': qty
+    }
+
+
+def read_balances():
+    """Positive balances with product/location names, in one indexed query"""
+    return [_as_item(row) for row in _balance_rows()]
+
+
+def iter_balances(chunk_size=5000):
+    """Same rows as read_balances(), fetched chunk_size at a time for streaming exports"""
+    for row in _balance_rows().yield_per(chunk_size):
+        yield _as_item(row)
+
+
+def signed_movements(model=ProductMovement, since=None, until=None):
+    """Movements as signed (product_id, location_id, qty) SELECTs to UNION ALL: +qty into to_location, -qty out of from_location.
+
+    since/until keep only timestamps in [since, until); model may be the archive table.
+    """
+    parts = []
+    for location, qty in ((model.to_location, model.qty), (model.from_location, -model.qty)):
+        query = select(
+            model.product_id.label('product_id'),
+            location.label('location_id'),
+            qty.label('qty')
+        ).where(location.isnot(None))
+        if since is not None:
+            query = query.where(model.timestamp >= since)
+        if until is not None:
+            query = query.where(model.timestamp < until)
+        parts.append(query)
+    return parts
+
+
+def product_balances(product_id):
+    """Non-zero balances of one product as [{'location_id', 'qty'}], read by primary key"""
+    rows = db.session.query(StockBalance.location_id, StockBalance.qty) \
+        .filter(StockBalance.product_id == product_id, StockBalance.qty != 0) \
+        .order_by(StockBalance.location_id)
+    return [{'location_id': location_id, 'qty': qty} for location_id, qty in rows]
+
+
+def location_balances(location_id):
+    """Non-zero balances at one location as [{'product_id', 'qty'}], through ix_stock_balance_location_id"""
+    rows = db.session.query(StockBalance.product_id, StockBalance.qty) \
+        .filter(StockBalance.location_id == location_id, StockBalance.qty != 0) \
+        .order_by(StockBalance.product_id)
+    return [{'product_id': product_id, 'qty': qty} for product_id, qty in rows]
+
+
+def keys_filter(keys):
+    """Balance rows for (product_id, location_id) pairs.
+
+    An OR of equalities rather than a row value IN list, which SQLite answers with a
+    table scan; this way each pair is one primary key lookup.
+    """
+    return or_(*[and_(StockBalance.product_id == product_id, StockBalance.location_id == location_id)
+                 for product_id, location_id in keys])
+
+
+def balances_for_keys(keys, chunk_size=400):
+    """Balance of each (product_id, location_id) in keys, 0 where there is none, in the order given"""
+    keys = list(keys)
+    found = {}
+    # Chunked to stay under SQLite's bound parameter and expression depth limits
+    for i in range(0, len(keys), chunk_size):
+        rows = db.session.query(StockBalance.product_id, StockBalance.location_id, StockBalance.qty) \
+            .filter(keys_filter(keys[i:i + chunk_size]))
+        found.update(((product_id, location_id), qty) for product_id, location_id, qty in rows)
+    return [{'product_id': product_id, 'location_id': location_id, 'qty': found.get((product_id, location_id), 0)}
+            for product_id, location_id in keys]
+
+
+def _signed_movements():
+    """The whole movement log as signed rows; after compaction the compacted snapshot stands in for the archived part"""
+    from snapshots import compacted_snapshot, snapshot_rows
+    parts = signed_movements()
+    snapshot = compacted_snapshot()
+    if snapshot is not None:
+        parts.append(snapshot_rows(snapshot.snapshot_id))
+    return union_all(*parts).subquery()
+
+
+def sum_movements():
+    """Every (product, location) balance from the movement log, summed in one GROUP BY"""
+    signed = _signed_movements()
+    rows = db.session.query(
+        signed.c.product_id,
+        signed.c.location_id,
+        func.sum(signed.c.qty)
+    ).group_by(signed.c.product_id, signed.c.location_id)
+    return {(product_id, location_id): qty for product_id, location_id, qty in rows}
+
+
+def aggregate_balances():
+    """Positive balances with names, aggregated from the movement log in a single statement"""
+    signed = _signed_movements()
+    totals = db.session.query(
+        signed.c.product_id,
+        signed.c.location_id,
+        func.sum(signed.c.qty).label('qty')
+    ).group_by(signed.c.product_id, signed.c.location_id) \
+     .having(func.sum(signed.c.qty) > 0) \
+     .subquery()
+
+    rows = db.session.query(
+        totals.c.product_id,
+        Product.name,
+        totals.c.location_id,
+        Location.name,
+        totals.c.qty
+    ).join(Product, Product.product_id == totals.c.product_id) \
+     .join(Location, Location.location_id == totals.c.location_id) \
+     .order_by(Product.name, Location.name) \
+     .all()
+
+    return [_as_item(row) for row in rows]
+
+
+def verify_ledger():
+    """Compare the ledger with the movement log.
+
+    Returns a list of (product_id, location_id, ledger_qty, expected_qty) for every key that drifted.
+    """
+    expected = sum_movements()
+    stored = {(b.product_id, b.location_id): b.qty for b in StockBalance.query.all()}
+
+    drift = []
+    for key in sorted(set(expected) | set(stored)):
+        have = stored.get(key, 0)
+        want = expected.get(key, 0)
+        if have != want:
+            drift.append((key[0], key[1], have, want))
+    return drift
+
+
+def rebuild_ledger():
+    """Throw away the ledger and rebuild it from the movement log. Returns the drift that was fixed."""
+    drift = verify_ledger()
+    StockBalance.query.delete()
+    db.session.bulk_insert_mappings(StockBalance, [
+        {'product_id': product_id, 'location_id': location_id, 'qty': qty}
+        for (product_id, location_id), qty in sum_movements().items() if qty
+    ])
+    db.session.commit()
+    return drift
@@ -0,0 +1,155 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import or_, exists, select, tuple_, union
+from sqlalchemy.orm import joinedload
+from models import db, ProductMovement, ProductMovementArchive
+
+Page = namedtuple('Page', ['items', 'newer_cursor', 'older_cursor'])
+
+
+def encode_cursor(movement):
+    return f'{movement.timestamp.isoformat()},{movement.movement_id}'
+
+
+def decode_cursor(cursor):
+    """Turn a cursor back into (timestamp, movement_id), or None if it is malformed"""
+    try:
+        timestamp, movement_id = cursor.rsplit(',', 1)
+        return datetime.fromisoformat(timestamp), int(movement_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+
+def movement_filters(product_id=None, date_from=None, date_to=None):
+    """WHERE criteria of the movement filters other than location"""
+    criteria = []
+    if product_id:
+        criteria.append(ProductMovement.product_id == product_id)
+    if date_from:
+        criteria.append(ProductMovement.timestamp >= date_from)
+    if date_to:
+        # date_to is inclusive, so stop at the start of the next day
+        criteria.append(ProductMovement.timestamp < date_to + timedelta(days=1))
+    return criteria
+
+
+def _keyset(statement, position, newer):
+    """statement narrowed to the rows past position (a (timestamp, movement_id) or None), ordered away from it"""
+    timestamp, movement_id = ProductMovement.timestamp, ProductMovement.movement_id
+    if position:
+        key, bound = tuple_(timestamp, movement_id), tuple_(*position)
+        # The timestamp bound on its own lets SQLite seek the index range; the row value settles ties
+        if newer:
+            statement = statement.filter(timestamp >= position[0], key > bound)
+        else:
+            statement = statement.filter(timestamp <= position[0], key < bound)
+    if newer:
+        return statement.order_by(timestamp.asc(), movement_id.asc())
+    return statement.order_by(timestamp.desc(), movement_id.desc())
+
+
+def movements_page_query(position=None, newer=False, per_page=50, product_id=None, location_id=None,
+                         date_from=None, date_to=None):
+    """Query for per_page + 1 movements past position, with product and locations joined in.
+
+    Every filter has an index ordered by (timestamp, movement_id) to walk, so a page
+    reads about per_page entries however long the history is. A location matches
+    movements out of it or into it: two index ranges, each cut to a page and then
+    combined with a UNION, where an OR would sort all of the location's movements.
+    """
+    query = ProductMovement.query.options(
+        joinedload(ProductMovement.product),
+        joinedload(ProductMovement.from_loc),
+        joinedload(ProductMovement.to_loc)
+    )
+    criteria = movement_filters(product_id, date_from, date_to)
+    if not location_id:
+        return _keyset(query.filter(*criteria), position, newer).limit(per_page + 1)
+    sides = [_keyset(select(ProductMovement.movement_id).where(column == location_id, *criteria), position, newer)
+             .limit(per_page + 1).subquery()
+             for column in (ProductMovement.from_location, ProductMovement.to_location)]
+    page_ids = union(*[select(side.c.movement_id) for side in sides])
+    return _keyset(query.filter(ProductMovement.movement_id.in_(page_ids)), None, newer).limit(per_page + 1)
+
+
+def movements_page(cursor=None, direction='older', per_page=50, **filters):
+    """One page of movements, newest first, using keyset pagination on (timestamp, movement_id).
+
+    cursor is the boundary row from the previous page; direction says whether to fetch
+    the rows older or newer than it. Cost depends on the page size, not the table size.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    newer = bool(position) and direction == 'newer'
+
+    # One extra row tells whether there is another page in this direction
+    rows = movements_page_query(position, newer, per_page, **filters).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if newer:
+        rows.reverse()
+        has_newer, has_older = more, True
+    else:
+        has_newer, has_older = bool(position), more
+
+    return Page(
+        items=rows,
+        newer_cursor=encode_cursor(rows[0]) if rows and has_newer else None,
+        older_cursor=encode_cursor(rows[-1]) if rows and has_older else None
+    )
+
+
+def movements_after(movement_id=0, limit=500):
+    """Up to limit movements with an ID above movement_id, oldest first (for clients polling for new ones)"""
+    return ProductMovement.query.filter(ProductMovement.movement_id > movement_id) \
+        .order_by(ProductMovement.movement_id).limit(limit).all()
+
+
+def movement_dict(movement):
+    return {
+        'movement_id': movement.movement_id,
+        'timestamp': movement.timestamp.isoformat(),
+        'product_id': movement.product_id,
+        'from_location': movement.from_location,
+        'to_location': movement.to_location,
+        'qty': movement.qty,
+        'notes': movement.notes
+    }
+
+
+def recent_movements(limit=5):
+    """Newest movements for the dashboard"""
+    return movements_page(per_page=limit).items
+
+
+def product_has_movements_query(product_id):
+    return select(or_(
+        exists().where(ProductMovement.product_id == product_id),
+        exists().where(ProductMovementArchive.product_id == product_id)
+    ))
+
+
+def location_has_movements_query(location_id):
+    return select(or_(
+        exists().where(ProductMovement.from_location == location_id),
+        exists().where(ProductMovement.to_location == location_id),
+        exists().where(ProductMovementArchive.from_location == location_id),
+        exists().where(ProductMovementArchive.to_location == location_id)
+    ))
+
+
+def product_has_movements(product_id):
+    """EXISTS checks on the product_id indexes (live and archived) instead of loading product.movements"""
+    return db.session.execute(product_has_movements_query(product_id)).scalar()
+
+
+def location_has_movements(location_id):
+    """EXISTS checks on the from/to location indexes (live and archived) instead of loading both backref lists"""
+    return db.session.execute(location_has_movements_query(location_id)).scalar()
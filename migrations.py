@@ -0,0 +1,221 @@
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex
+from models import db, ProductMovement, StockBalance, SchemaMigration
+
+
+def _create_indexes(*names):
+    """Create the named indexes from the models, skipping any that already exist"""
+    # IF NOT EXISTS rather than checkfirst: reflection can't see expression indexes like lower(name)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name in names:
+                    connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _create_tables():
+    db.create_all()
+
+
+def _build_ledger():
+    from ledger import rebuild_ledger
+    if not StockBalance.query.first() and ProductMovement.query.first():
+        rebuild_ledger()
+
+
+def _index_product_search_and_movement_history():
+    _create_indexes('ix_product_name_lower', 'ix_product_movement_timestamp_id')
+
+
+def _index_movement_lookups():
+    _create_indexes(
+        'ix_product_movement_product_to',
+        'ix_product_movement_product_from',
+        'ix_product_movement_to_location',
+        'ix_product_movement_from_location',
+        'ix_stock_balance_location_id'
+    )
+
+
+def _create_snapshot_tables():
+    # Only creates the tables that are missing: balance_snapshot, snapshot_balance, product_movement_archive
+    db.create_all()
+
+
+def _index_catalog_listings():
+    _create_indexes(
+        'ix_product_name_lower_id',
+        'ix_product_category_name',
+        'ix_product_created_at_id',
+        'ix_location_name_lower_id',
+        'ix_location_created_at_id'
+    )
+    if db.engine.dialect.name != 'sqlite':
+        return
+    from catalog import FTS_TABLES, fts_statements
+    with db.engine.begin() as connection:
+        for table in FTS_TABLES:
+            for statement in fts_statements(table):
+                connection.execute(db.text(statement))
+
+
+def _create_change_event_table():
+    # Only creates the missing change_event table
+    db.create_all()
+
+
+def _create_demand_stat_table():
+    # Only creates the missing demand_stat table, then fills it from the movement history
+    from flask import current_app
+    from analytics import refresh_demand
+    db.create_all()
+    refresh_demand(current_app.config)
+
+
+def _index_filtered_movement_history():
+    _create_indexes(
+        'ix_product_movement_product_timestamp_id',
+        'ix_product_movement_to_location_timestamp_id',
+        'ix_product_movement_from_location_timestamp_id'
+    )
+    # The new location indexes start with the same column, so these only slow down writes
+    with db.engine.begin() as connection:
+        for name in ('ix_product_movement_to_location', 'ix_product_movement_from_location'):
+            connection.execute(db.text(f'DROP INDEX IF EXISTS {name}'))
+
+
+def _index_demand_window():
+    _create_indexes('ix_product_movement_product_from_timestamp')
+    # Superseded: the new index starts with the same columns
+    with db.engine.begin() as connection:
+        connection.execute(db.text('DROP INDEX IF EXISTS ix_product_movement_product_from'))
+
+
+# Applied in order, each exactly once per database. Add new steps at the end; never edit old ones.
+# db.create_all() only creates missing tables, so anything that changes an existing table
+# (new index, new column) needs its own step here.
+MIGRATIONS = [
+    (1, 'Create tables', _create_tables),
+    (2, 'Build the stock balance ledger from the movement history', _build_ledger),
+    (3, 'Index product names and the movement history order', _index_product_search_and_movement_history),
+    (4, 'Index movements by product/location and stock balances by location', _index_movement_lookups),
+    (5, 'Create balance snapshot and movement archive tables', _create_snapshot_tables),
+    (6, 'Index the product and location listings, with FTS5 full-text search on SQLite', _index_catalog_listings),
+    (7, 'Create the change_event table for the live stock change feed', _create_change_event_table),
+    (8, 'Create the demand_stat table with velocity and reorder points per product and location',
+        _create_demand_stat_table),
+    (9, 'Index movements by product and by location in history order', _index_filtered_movement_history),
+    (10, 'Index outbound movements by product, location and time for demand', _index_demand_window),
+]
+
+
+def current_version():
+    if not inspect(db.engine).has_table(SchemaMigration.__tablename__):
+        return 0
+    return db.session.query(db.func.max(SchemaMigration.version)).scalar() or 0
+
+
+def upgrade():
+    """Apply every migration newer than the database. Returns the (version, description) pairs applied."""
+    version = current_version()
+    applied = []
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        step()
+        if not inspect(db.engine).has_table(SchemaMigration.__tablename__):
+            SchemaMigration.__table__.create(db.engine)
+        db.session.add(SchemaMigration(version=number, description=description))
+        db.session.commit()
+        applied.append((number, description))
+    return applied
+
+
+def hot_queries():
+    """The movement queries the indexes exist for, as (name, statement) pairs"""
+    from datetime import datetime
+    from listings import movements_page_query, product_has_movements_query, location_has_movements_query
+    from snapshots import balances_as_of_query
+    from catalog import products_page_query, locations_page_query
+    from ledger import keys_filter
+    from analytics import demand_query
+    position = (datetime(2000, 1, 1), 1)
+    return [
+        ('recent movements', movements_page_query(per_page=5).statement),
+        ('movements by product', movements_page_query(product_id='P').statement),
+        ('movements by product, later page', movements_page_query(position, product_id='P').statement),
+        ('movements by location', movements_page_query(location_id='L').statement),
+        ('movements by location, later page', movements_page_query(position, location_id='L').statement),
+        ('movements in date range', movements_page_query(date_from=datetime(2000, 1, 1),
+                                                         date_to=datetime(2000, 1, 2)).statement),
+        ('product has movements', product_has_movements_query('P')),
+        ('location has movements', location_has_movements_query('L')),
+        ('stock at location', StockBalance.query.filter_by(location_id='L').statement),
+        ('stock of product', StockBalance.query.filter_by(product_id='P').statement),
+        ('stock for keys', StockBalance.query.filter(keys_filter([('P', 'L'), ('Q', 'M')])).statement),
+        ('movements after cursor', ProductMovement.query.filter(ProductMovement.movement_id > 0)
+            .order_by(ProductMovement.movement_id).limit(500).statement),
+        ('stock as of date', balances_as_of_query(datetime(2000, 1, 1))),
+        ('product listing by name', products_page_query(sort='name', position=['m', 'P'])),
+        ('product listing by category', products_page_query(category='Phone', sort='name', position=['phone', 'P'])),
+        ('product listing newest first', products_page_query(position=[datetime(2000, 1, 1), 'P'])),
+        ('product search', products_page_query(q='P0')),
+        ('location listing by name', locations_page_query(sort='name', position=['m', 'L'])),
+        ('demand in window', demand_query(datetime(2000, 1, 1))),
+        ('demand for keys', demand_query(datetime(2000, 1, 1), [('P', 'L'), ('Q', 'M')])),
+    ]
+
+
+SCAN_CHECKED_TABLES = ('product_movement', 'product_movement_archive', 'stock_balance', 'product', 'location')
+
+
+def _reads_range(line):
+    """Plan line reading a checked table by a full scan or a secondary index range (not a primary key lookup)"""
+    words = line.split()
+    return (words[:1] in (['SCAN'], ['SEARCH']) and words[1:2] and words[1] in SCAN_CHECKED_TABLES
+            and 'PRIMARY KEY' not in line and 'sqlite_autoindex' not in line)
+
+
+def _sorts_range(plan):
+    """True if a temp B-tree ORDER BY sorts rows read straight from a checked table by a scan or index range.
+
+    That sort covers every matching row however small the LIMIT. Sorting the output
+    of a subquery, or rows fetched by primary key from one, is bounded by the subquery.
+    """
+    children = {}
+    for node_id, parent, _, line in plan:
+        children.setdefault(parent, []).append((node_id, line))
+
+    def sources(parent):
+        # Rows of this query level, including the branches of a MULTI-INDEX OR but not subqueries
+        for node_id, line in children.get(parent, []):
+            yield line
+            if line.startswith(('MULTI-INDEX OR', 'INDEX ')):
+                yield from sources(node_id)
+
+    return any(line.startswith('USE TEMP B-TREE FOR') and 'ORDER BY' in line
+               and any(_reads_range(source) for source in sources(parent))
+               for _, parent, _, line in plan)
+
+
+def check_query_plans():
+    """EXPLAIN QUERY PLAN each hot query (SQLite only).
+
+    Returns (name, plan lines, problem) for each, where problem is None, 'FULL SCAN'
+    of the movement, balance, product or location tables, or 'SORTS ALL MATCHES'
+    (see _sorts_range).
+    """
+    results = []
+    for name, statement in hot_queries():
+        plan = [tuple(row) for row in db.session.execute(db.text(
+            'EXPLAIN QUERY PLAN ' + str(statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        ))]
+        lines = [line for _, _, _, line in plan]
+        problem = None
+        if any(line.split()[:2] in (['SCAN', table] for table in SCAN_CHECKED_TABLES) and 'USING' not in line
+               for line in lines):
+            problem = 'FULL SCAN'
+        elif _sorts_range(plan):
+            problem = 'SORTS ALL MATCHES'
+        results.append((name, lines, problem))
+    return results
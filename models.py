@@ -18,6 +18,15 @@ class Product(db.Model):
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        # Case-insensitive prefix search for the product autocomplete
+        db.Index('ix_product_name_lower', db.func.lower(name)),
+        # Sort orders of the product listing (see catalog.PRODUCT_SORTS)
+        db.Index('ix_product_name_lower_id', db.func.lower(name), 'product_id'),
+        db.Index('ix_product_category_name', 'category', db.func.lower(name), 'product_id'),
+        db.Index('ix_product_created_at_id', 'created_at', 'product_id'),
+    )
+    
     def __repr__(self):
         return f'<Product {self.product_id}: {self.name}>'
 
@@ -27,6 +36,12 @@ class Location(db.Model):
     address = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        # Sort orders of the location listing (see catalog.LOCATION_SORTS)
+        db.Index('ix_location_name_lower_id', db.func.lower(name), 'location_id'),
+        db.Index('ix_location_created_at_id', 'created_at', 'location_id'),
+    )
+    
     def __repr__(self):
         return f'<Location {self.location_id}: {self.name}>'
 
@@ -44,5 +59,132 @@ class ProductMovement(db.Model):
     from_loc = db.relationship('Location', foreign_keys=[from_location], backref='outgoing_movements')
     to_loc = db.relationship('Location', foreign_keys=[to_location], backref='incoming_movements')
     
+    __table_args__ = (
+        # Keyset pagination of the movement history (newest first) and recent movements
+        db.Index('ix_product_movement_timestamp_id', 'timestamp', 'movement_id'),
+        # Per-product balance lookups, and the "product has movements" check on delete;
+        # with the timestamp, outbound demand per key over the demand window too
+        db.Index('ix_product_movement_product_to', 'product_id', 'to_location'),
+        db.Index('ix_product_movement_product_from_timestamp', 'product_id', 'from_location', 'timestamp'),
+        # The same pagination filtered by product or location (in and out), and the
+        # "location has movements" check on delete
+        db.Index('ix_product_movement_product_timestamp_id', 'product_id', 'timestamp', 'movement_id'),
+        db.Index('ix_product_movement_to_location_timestamp_id', 'to_location', 'timestamp', 'movement_id'),
+        db.Index('ix_product_movement_from_location_timestamp_id', 'from_location', 'timestamp', 'movement_id'),
+    )
+    
+    def __repr__(self):
+        return f'<Movement {self.movement_id}: {self.qty}x {self.product_id}>'
+
+class StockBalance(db.Model):
+    """Running stock per (product, location), kept in step with ProductMovement"""
+    product_id = db.Column(db.String(20), db.ForeignKey('product.product_id'), primary_key=True)
+    location_id = db.Column(db.String(20), db.ForeignKey('location.location_id'), primary_key=True)
+    qty = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Relationships
+    product = db.relationship('Product')
+    location = db.relationship('Location')
+    
+    __table_args__ = (
+        db.Index('ix_stock_balance_location_id', 'location_id'),
+    )
+    
+    def __repr__(self):
+        return f'<StockBalance {self.product_id}@{self.location_id}: {self.qty}>'
+
+
+class BalanceSnapshot(db.Model):
+    """Checkpoint of every balance, covering the movements with timestamp < taken_at"""
+    snapshot_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    taken_at = db.Column(db.DateTime, unique=True, nullable=False)
+    movement_count = db.Column(db.Integer, nullable=False, default=0)   # Movements since the previous snapshot
+    # Set once the movements before taken_at have been moved to product_movement_archive
+    compacted = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<BalanceSnapshot {self.snapshot_id} @ {self.taken_at}>'
+
+
+class SnapshotBalance(db.Model):
+    """One non-zero (product, location) balance in a snapshot"""
+    snapshot_id = db.Column(db.Integer, db.ForeignKey('balance_snapshot.snapshot_id'), primary_key=True)
+    product_id = db.Column(db.String(20), db.ForeignKey('product.product_id'), primary_key=True)
+    location_id = db.Column(db.String(20), db.ForeignKey('location.location_id'), primary_key=True)
+    qty = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<SnapshotBalance {self.snapshot_id}: {self.product_id}@{self.location_id}: {self.qty}>'
+
+
+class ProductMovementArchive(db.Model):
+    """Movements moved out of product_movement by compaction; a compacted snapshot stands in for them"""
+    archive_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    movement_id = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    from_location = db.Column(db.String(20), db.ForeignKey('location.location_id'), nullable=True)
+    to_location = db.Column(db.String(20), db.ForeignKey('location.location_id'), nullable=True)
+    product_id = db.Column(db.String(20), db.ForeignKey('product.product_id'), nullable=False)
+    qty = db.Column(db.Integer, nullable=False)
+    notes = db.Column(db.String(200))
+    
+    __table_args__ = (
+        # Point-in-time queries older than the compaction horizon
+        db.Index('ix_product_movement_archive_timestamp', 'timestamp'),
+        # "Has movements" checks before deleting a product or location
+        db.Index('ix_product_movement_archive_product_id', 'product_id'),
+        db.Index('ix_product_movement_archive_to_location', 'to_location'),
+        db.Index('ix_product_movement_archive_from_location', 'from_location'),
+    )
+    
+    def __repr__(self):
+        return f'<ProductMovementArchive {self.movement_id}>'
+
+
+class LowStockAlert(db.Model):
+    """A low stock alert already sent for a (product, location); removed once stock recovers"""
+    product_id = db.Column(db.String(20), db.ForeignKey('product.product_id'), primary_key=True)
+    location_id = db.Column(db.String(20), db.ForeignKey('location.location_id'), primary_key=True)
+    qty = db.Column(db.Integer, nullable=False)
+    sent_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<LowStockAlert {self.product_id}@{self.location_id}: {self.qty}>'
+
+
+class DemandStat(db.Model):
+    """Outbound demand per (product, location) over the demand window; see analytics.py"""
+    product_id = db.Column(db.String(20), db.ForeignKey('product.product_id'), primary_key=True)
+    location_id = db.Column(db.String(20), db.ForeignKey('location.location_id'), primary_key=True)
+    velocity = db.Column(db.Float, nullable=False)           # Mean units out per day
+    reorder_point = db.Column(db.Integer, nullable=False)    # Low stock at or below this
+    window_start = db.Column(db.Date, nullable=False)        # First day the figures cover
+    
+    def __repr__(self):
+        return f'<DemandStat {self.product_id}@{self.location_id}: {self.velocity:.2f}/day>'
+
+
+class ChangeEvent(db.Model):
+    """A (product, location) balance changed to qty; product_id NULL means reload everything"""
+    # AUTOINCREMENT so a sequence number is never reused, even after pruning
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    product_id = db.Column(db.String(20))
+    location_id = db.Column(db.String(20))
+    qty = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<ChangeEvent {self.seq}: {self.product_id}@{self.location_id} = {self.qty}>'
+
+
+class SchemaMigration(db.Model):
+    """Migrations from migrations.MIGRATIONS that have been applied to this database"""
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
     def __repr__(self):
-        return f'<Movement {self.movement_id}: {self.qty}x {self.product_id}>'
\ No newline at end of file
+        return f'<SchemaMigration {self.version}: {self.description}>'
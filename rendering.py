@@ -0,0 +1,74 @@
+import gzip
+import os
+from flask import request
+from jinja2 import FileSystemBytecodeCache
+
+# Response types worth compressing; images, PDFs and archives are compressed already
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+                          'application/javascript', 'application/json', 'image/svg+xml'}
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    """Compiled templates on disk, shared by every worker and kept across restarts.
+
+    Creates its directory on the first write, so importing the app writes nothing.
+    """
+
+    def dump_bytecode(self, bucket):
+        os.makedirs(self.directory, exist_ok=True)
+        super().dump_bytecode(bucket)
+
+
+def init_rendering(app):
+    """Template bytecode cache, plus ETags and gzip for text responses.
+
+    Call before the Jinja environment is first used. JINJA_CACHE_DIR=False turns
+    the bytecode cache off, COMPRESS_LEVEL=0 turns compression off.
+    """
+    directory = app.config.get('JINJA_CACHE_DIR')
+    if directory is not False:
+        directory = directory or os.path.join(app.instance_path, 'jinja_cache')
+        app.jinja_options = {**app.jinja_options, 'bytecode_cache': TemplateBytecodeCache(directory)}
+
+    level = app.config.get('COMPRESS_LEVEL', 1)
+    min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+
+    @app.after_request
+    def _compress(response):
+        return compress_response(response, level, min_size)
+
+
+def compress_response(response, level=1, min_size=1024):
+    """Gzip a full text response; on GET, add an ETag and answer If-None-Match with a 304 instead.
+
+    The ETag is a hash of the uncompressed body (unless the view set one), made
+    weak when the body is gzipped: both encodings are the same page, so either
+    one's ETag revalidates the other. Streams (SSE, CSV exports) and files are
+    passed through untouched.
+    """
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    compress = level and len(response.get_data()) >= min_size and 'gzip' in request.accept_encodings
+    if request.method in ('GET', 'HEAD'):
+        if not response.cache_control:
+            # Pages are per user; browsers may keep them but must revalidate (a 304 when nothing changed)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+        etag, weak = response.get_etag()
+        if etag is None:
+            response.add_etag()
+            etag, weak = response.get_etag()
+        if compress and not weak:
+            response.set_etag(etag, weak=True)
+        response.make_conditional(request)
+        if response.status_code != 200:
+            return response
+    if not compress:
+        return response
+
+    response.set_data(gzip.compress(response.get_data(), compresslevel=level, mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
@@ -0,0 +1,177 @@
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import func, insert, literal, select, union_all
+from models import db, Product, Location, ProductMovement, ProductMovementArchive, BalanceSnapshot, SnapshotBalance
+from ledger import signed_movements, _as_item
+
+ARCHIVE_COLUMNS = ['movement_id', 'timestamp', 'from_location', 'to_location', 'product_id', 'qty', 'notes']
+
+
+def parse_as_of(value):
+    """'YYYY-MM-DD' means the end of that day; a full ISO datetime is used as is. None if malformed."""
+    try:
+        moment = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if len(value) == 10:
+        moment += timedelta(days=1)
+    return moment
+
+
+def snapshot_rows(snapshot_id):
+    """A snapshot's balances as signed (product_id, location_id, qty) rows, to UNION ALL with movements"""
+    return select(
+        SnapshotBalance.product_id.label('product_id'),
+        SnapshotBalance.location_id.label('location_id'),
+        SnapshotBalance.qty.label('qty')
+    ).where(SnapshotBalance.snapshot_id == snapshot_id)
+
+
+def compacted_snapshot():
+    """The newest compacted snapshot; movements before its taken_at are in the archive. None if never compacted."""
+    return BalanceSnapshot.query.filter_by(compacted=True).order_by(BalanceSnapshot.taken_at.desc()).first()
+
+
+def history_horizon():
+    """Oldest timestamp still in product_movement, or None when nothing has been archived"""
+    snapshot = compacted_snapshot()
+    return snapshot.taken_at if snapshot else None
+
+
+def archived_balances():
+    """Balances the archived movements add up to, as {(product_id, location_id): qty}"""
+    snapshot = compacted_snapshot()
+    if snapshot is None:
+        return {}
+    return {(product_id, location_id): qty
+            for product_id, location_id, qty in db.session.execute(snapshot_rows(snapshot.snapshot_id))}
+
+
+def nearest_snapshot(moment):
+    """The newest snapshot taken at or before moment"""
+    return BalanceSnapshot.query.filter(BalanceSnapshot.taken_at <= moment) \
+        .order_by(BalanceSnapshot.taken_at.desc()).first()
+
+
+def _history(moment, base):
+    """Signed rows that add up to the balances at moment: base's balances plus the movements after it.
+
+    Only movements with base.taken_at <= timestamp < moment are read, through the
+    timestamp index, so the cost depends on the snapshot spacing and not on the
+    length of the history. Windows older than the compaction horizon read the archive.
+    """
+    since = base.taken_at if base else None
+    parts = signed_movements(since=since, until=moment)
+    horizon = history_horizon()
+    if horizon is not None and (since is None or since < horizon):
+        parts += signed_movements(ProductMovementArchive, since=since, until=min(moment, horizon))
+    if base is not None:
+        parts.append(snapshot_rows(base.snapshot_id))
+    return union_all(*parts).subquery()
+
+
+def balances_as_of_query(moment):
+    history = _history(moment, nearest_snapshot(moment))
+    totals = select(
+        history.c.product_id,
+        history.c.location_id,
+        func.sum(history.c.qty).label('qty')
+    ).group_by(history.c.product_id, history.c.location_id) \
+     .having(func.sum(history.c.qty) > 0) \
+     .subquery()
+    return select(
+        totals.c.product_id,
+        Product.name,
+        totals.c.location_id,
+        Location.name,
+        totals.c.qty
+    ).join(Product, Product.product_id == totals.c.product_id) \
+     .join(Location, Location.location_id == totals.c.location_id) \
+     .order_by(Product.name, Location.name)
+
+
+def balances_as_of(moment):
+    """Positive balances counting the movements with timestamp < moment, in the same shape as read_balances()"""
+    return [_as_item(row) for row in db.session.execute(balances_as_of_query(moment))]
+
+
+def _take_snapshot(moment, previous, movement_count):
+    snapshot = BalanceSnapshot(taken_at=moment, movement_count=movement_count)
+    db.session.add(snapshot)
+    db.session.flush()
+    history = _history(moment, previous)
+    qty = func.sum(history.c.qty)
+    db.session.execute(insert(SnapshotBalance).from_select(
+        ['snapshot_id', 'product_id', 'location_id', 'qty'],
+        select(literal(snapshot.snapshot_id), history.c.product_id, history.c.location_id, qty)
+        .group_by(history.c.product_id, history.c.location_id)
+        .having(qty != 0)
+    ))
+    return snapshot
+
+
+def take_snapshots(min_movements=1, settle=timedelta(minutes=5), now=None):
+    """Checkpoint the balances at each midnight where min_movements movements have built up since the last snapshot.
+
+    min_movements=1 gives one snapshot per day with activity; larger values space them
+    out to roughly every min_movements movements. Each snapshot is built from the
+    previous one plus the movements in between. Only days that ended at least settle
+    ago are considered, so movements still being committed are not missed. Commits
+    and returns the new snapshots.
+    """
+    now = now or datetime.utcnow()
+    cutoff = datetime.combine((now - settle).date(), time())
+    previous = BalanceSnapshot.query.order_by(BalanceSnapshot.taken_at.desc()).first()
+
+    day = func.date(ProductMovement.timestamp)
+    per_day = db.session.query(day, func.count()).filter(ProductMovement.timestamp < cutoff)
+    if previous is not None:
+        per_day = per_day.filter(ProductMovement.timestamp >= previous.taken_at)
+
+    created = []
+    pending = 0
+    for value, count in per_day.group_by(day).order_by(day).all():
+        pending += count
+        if pending < min_movements:
+            continue
+        # SQLite returns the day as text, PostgreSQL as a date
+        day_start = value if isinstance(value, date) else date.fromisoformat(value)
+        previous = _take_snapshot(datetime.combine(day_start + timedelta(days=1), time()), previous, pending)
+        created.append(previous)
+        pending = 0
+    db.session.commit()
+    return created
+
+
+def invalidate_snapshots(moment):
+    """Drop the snapshots made stale by a change to history at moment (a backdated import or a deleted movement).
+
+    Runs in the caller's transaction. Compacted snapshots are never dropped; changes
+    before the compaction horizon must be rejected instead.
+    """
+    stale = select(BalanceSnapshot.snapshot_id).where(BalanceSnapshot.taken_at > moment,
+                                                      BalanceSnapshot.compacted.is_(False))
+    SnapshotBalance.query.filter(SnapshotBalance.snapshot_id.in_(stale)).delete(synchronize_session=False)
+    BalanceSnapshot.query.filter(BalanceSnapshot.taken_at > moment, BalanceSnapshot.compacted.is_(False)) \
+        .delete(synchronize_session=False)
+
+
+def compact_history(before):
+    """Archive the movements behind the newest snapshot taken at or before `before`.
+
+    They are copied to product_movement_archive and deleted from product_movement, and
+    the snapshot is marked compacted so the ledger checks and balance engines start
+    from it. Returns (snapshot, movements archived); snapshot is None if there is no
+    snapshot that old.
+    """
+    snapshot = nearest_snapshot(before)
+    if snapshot is None or snapshot.compacted:
+        return snapshot, 0
+    old = ProductMovement.timestamp < snapshot.taken_at
+    db.session.execute(insert(ProductMovementArchive).from_select(
+        ARCHIVE_COLUMNS,
+        select(*[ProductMovement.__table__.c[name] for name in ARCHIVE_COLUMNS]).where(old)
+    ))
+    archived = ProductMovement.query.filter(old).delete(synchronize_session=False)
+    snapshot.compacted = True
+    db.session.commit()
+    return snapshot, archived
@@ -0,0 +1,32 @@
+from flask_login import UserMixin
+from models import db, User
+
+
+class SessionUser(UserMixin):
+    """The logged-in user as pages see it: a read-only copy of the User row.
+
+    Not attached to a database session, so one copy can be cached and shared by
+    every request and thread of a worker.
+    """
+
+    def __init__(self, id, username, email, is_admin):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.is_admin = is_admin
+
+    def __repr__(self):
+        return f'<SessionUser {self.id} {self.username}>'
+
+
+def load_session_user(user_id, cache, version):
+    """SessionUser for user_id (None if there's no such user), from cache while the users version is unchanged"""
+    user = cache.get(user_id, version)
+    if user is None:
+        row = db.session.query(User.id, User.username, User.email, User.is_admin) \
+            .filter(User.id == user_id).first()
+        if row is None:
+            return None
+        user = SessionUser(*row)
+        cache.set(user_id, user, version)
+    return user
@@ -1,17 +1,49 @@
-from reportlab.lib.pagesizes import letter, A4 # type: ignore
-from reportlab.lib import colors # type: ignore
-from reportlab.lib.units import inch # type: ignore
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer # type: ignore
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle # type: ignore
+# ReportLab is imported where it's used, so importing the app stays fast
 from io import BytesIO
 from datetime import datetime
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 
-def generate_report_pdf(balance_data):
-    """Generate PDF report of inventory balance"""
-    buffer = BytesIO()
+BALANCE_TABLE_HEADER = ['Product ID', 'Product Name', 'Location', 'Quantity']
+
+def balance_table_style():
+    from reportlab.lib import colors # type: ignore
+    return [
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3b82f6')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 10),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f3f4f6')])
+    ]
+
+def _balance_table(rows):
+    """One chunk of the balance table, with the header repeated on every page it spans"""
+    from reportlab.lib.units import inch # type: ignore
+    from reportlab.platypus import Table, TableStyle # type: ignore
+    table = Table([BALANCE_TABLE_HEADER] + rows,
+                  colWidths=[1.5*inch, 2.5*inch, 2*inch, 1*inch],
+                  repeatRows=1)
+    table.setStyle(TableStyle(balance_table_style()))
+    return table
+
+def generate_report_pdf(balance_data, output=None, rows_per_table=500, as_of=None):
+    """Generate PDF report of inventory balance.
+
+    balance_data can be any iterable of balance dicts (e.g. a streaming query).
+    Rows are laid out in tables of rows_per_table so ReportLab never has to split
+    one huge table. as_of labels a historical report. Writes to output (a path or
+    file object) if given, otherwise returns a BytesIO.
+    """
+    from reportlab.lib import colors # type: ignore
+    from reportlab.lib.pagesizes import A4 # type: ignore
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle # type: ignore
+    from reportlab.lib.units import inch # type: ignore
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer # type: ignore
+    buffer = output if output is not None else BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4)
     elements = []
     styles = getSampleStyleSheet()
@@ -32,88 +64,53 @@ def generate_report_pdf(balance_data):
     date_text = f"Generated on: {datetime.now().strftime('%B %d, %Y at %I:%M %p')}"
     date_para = Paragraph(date_text, styles['Normal'])
     elements.append(date_para)
+    if as_of:
+        elements.append(Paragraph(f"Stock as of: {as_of}", styles['Normal']))
     elements.append(Spacer(1, 0.3*inch))
     
-    # Table data
-    data = [['Product ID', 'Product Name', 'Location', 'Quantity']]
+    # Table data, one table per chunk of rows
+    chunk = []
+    tables = 0
     for item in balance_data:
-        data.append([
+        chunk.append([
             item['product_id'],
             item['product_name'],
             item['location_name'],
             str(item['qty'])
         ])
+        if len(chunk) == rows_per_table:
+            elements.append(_balance_table(chunk))
+            tables += 1
+            chunk = []
+    if chunk or not tables:
+        elements.append(_balance_table(chunk))
     
-    # Create table
-    table = Table(data, colWidths=[1.5*inch, 2.5*inch, 2*inch, 1*inch])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3b82f6')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f3f4f6')])
-    ]))
-    
-    elements.append(table)
     doc.build(elements)
+    if output is not None:
+        return output
     buffer.seek(0)
     return buffer
 
-def send_low_stock_alert(product_name, product_id, location, qty, admin_email, config):
-    """Send email alert for low stock"""
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = config['MAIL_USERNAME']
-        msg['To'] = admin_email
-        msg['Subject'] = f'⚠️ Low Stock Alert: {product_name}'
-        
-        body = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif;">
-            <h2 style="color: #dc2626;">Low Stock Alert</h2>
-            <p>The following product is running low on stock:</p>
-            <table style="border-collapse: collapse; margin: 20px 0;">
-                <tr>
-                    <td style="padding: 8px; font-weight: bold;">Product:</td>
-                    <td style="padding: 8px;">{product_name} ({product_id})</td>
-                </tr>
-                <tr>
-                    <td style="padding: 8px; font-weight: bold;">Location:</td>
-                    <td style="padding: 8px;">{location}</td>
-                </tr>
-                <tr>
-                    <td style="padding: 8px; font-weight: bold;">Current Quantity:</td>
-                    <td style="padding: 8px; color: #dc2626; font-weight: bold;">{qty}</td>
-                </tr>
-            </table>
-            <p style="color: #666;">Please restock this item soon.</p>
-        </body>
-        </html>
-        """
-        
-        msg.attach(MIMEText(body, 'html'))
-        
-        server = smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'])
-        server.starttls()
-        server.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
-        server.send_message(msg)
-        server.quit()
-        return True
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        return False
+def calculate_balance(engine=None):
+    """Current stock balance for all products in all locations.
 
-def calculate_balance():
-    """Calculate current stock balance for all products in all locations"""
+    engine picks how it is computed (defaults to the BALANCE_ENGINE setting):
+    'ledger' reads the stock balance table, 'sql' aggregates the movement log
+    in one GROUP BY and 'replay' is the original Python replay.
+    """
+    from flask import current_app
+    engine = engine or current_app.config.get('BALANCE_ENGINE', 'ledger')
+    if engine not in BALANCE_ENGINES:
+        raise ValueError(f"Unknown balance engine: {engine}")
+    return BALANCE_ENGINES[engine]()
+
+def calculate_balance_replay():
+    """Calculate current stock balance by replaying every movement (reference implementation)"""
     from models import Product, Location, ProductMovement, db
+    from snapshots import archived_balances
     
-    balance = {}
+    # Movements archived by compact-history are summed up in their snapshot
+    balance = archived_balances()
     movements = ProductMovement.query.all()
     
     for movement in movements:
@@ -145,4 +142,18 @@ def calculate_balance():
                     'qty': qty
                 })
     
-    return sorted(result, key=lambda x: (x['product_name'], x['location_name']))
\ No newline at end of file
+    return sorted(result, key=lambda x: (x['product_name'], x['location_name']))
+
+def _ledger_balance():
+    from ledger import read_balances
+    return read_balances()
+
+def _sql_balance():
+    from ledger import aggregate_balances
+    return aggregate_balances()
+
+BALANCE_ENGINES = {
+    'ledger': _ledger_balance,
+    'sql': _sql_balance,
+    'replay': calculate_balance_replay,
+}